@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, List
+
+import aiohttp
+
+import metrics
+from cache import AsyncTTLCache
+from dictionary import HskDictionary
+
+
+logger = logging.getLogger(__name__)
+
+# safe to send again if the first attempt failed half way
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "DELETE"})
+
+
+def is_success(response_body: dict) -> bool:
+    return response_body.get("success") == True
+
+
+def word_level(word: dict) -> int:
+    return int(word.get("hsk_level") or word.get("level") or 0)
+
+
+class ChineseBeeApi:
+    # one pooled session for the whole process, created in main() and passed to handlers as `api`
+    def __init__(
+        self,
+        base_url: str,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        timeout: float = 10.0,
+        retries: int = 3,
+        backoff: float = 0.3,
+        match_ttl: float = 60 * 60,
+        details_ttl: float = 24 * 60 * 60,
+        cache_size: int = 4096,
+        saved_ttl: float = 30 * 60,
+        saved_cache_size: int = 10000,
+        dictionary: HskDictionary | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=min(timeout, 5.0))
+        self.retries = retries
+        self.backoff = backoff
+        self._session: aiohttp.ClientSession | None = None
+        # dictionary data barely changes, so lookups are cached per endpoint
+        self.match_cache = AsyncTTLCache(maxsize=cache_size, ttl=match_ttl)
+        self.details_cache = AsyncTTLCache(maxsize=cache_size, ttl=details_ttl)
+        # the api stays the source of truth, saving and deleting below keep this in sync
+        self.saved_cache = AsyncTTLCache(maxsize=saved_cache_size, ttl=saved_ttl)
+        # bundled hsk index, the api is only asked about words it does not know
+        self.dictionary = dictionary
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=60,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(base_url=self.base_url, connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method: str, path: str, endpoint: str | None = None, **kwargs) -> dict:
+        # endpoint is the path template used as metrics label, e.g. /word-details/{id}
+        endpoint = endpoint or path
+        attempts = self.retries + 1 if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                async with self.session.request(method, path, **kwargs) as response:
+                    metrics.upstream_responses.inc(method, endpoint, str(response.status))
+                    if response.status >= 500 and not last:
+                        logger.warning("api %s %s returned %s, retrying", method, path, response.status)
+                    else:
+                        return await response.json(content_type=None)
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as error:
+                metrics.upstream_responses.inc(method, endpoint, "timeout" if isinstance(error, asyncio.TimeoutError) else "error")
+                if last:
+                    raise
+                logger.warning("api %s %s failed with %r, retrying", method, path, error)
+            finally:
+                metrics.upstream_seconds.observe(time.perf_counter() - started, method, endpoint)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def get(self, path: str, endpoint: str | None = None, **kwargs) -> dict:
+        return await self.request("GET", path, endpoint, **kwargs)
+
+    async def post(self, path: str, endpoint: str | None = None, **kwargs) -> dict:
+        return await self.request("POST", path, endpoint, **kwargs)
+
+    async def delete(self, path: str, endpoint: str | None = None, **kwargs) -> dict:
+        return await self.request("DELETE", path, endpoint, **kwargs)
+
+    # MARK: endpoints
+
+    async def chinese_match(self, word: str) -> dict:
+        if self.dictionary is not None:
+            matches = self.dictionary.search(word)
+            if matches:
+                return {"success": True, "match": matches}
+        return await self.match_cache.get_or_load(
+            word, lambda: self.get(f"/chinese-match/{word}", "/chinese-match/{word}"), should_cache=is_success
+        )
+
+    async def word_details(self, word_id: int) -> dict:
+        return await self.details_cache.get_or_load(
+            word_id, lambda: self.get(f"/word-details/{word_id}", "/word-details/{id}"), should_cache=is_success
+        )
+
+    async def saved_words(self, user_id: int, fresh: bool = False) -> dict:
+        # cached lists are shared between handlers, never mutate them in place
+        if fresh:
+            self.saved_cache.pop(user_id)
+        return await self.saved_cache.get_or_load(
+            user_id, lambda: self.get("/saved-words", params={"user_id": user_id}), should_cache=is_success
+        )
+
+    async def saved_words_page(self, user_id: int, page: int, page_size: int, level: int = 0) -> dict:
+        # the api has no paging, pages are sliced out of the cached list
+        response_body = await self.saved_words(user_id)
+        if not is_success(response_body):
+            return response_body
+        saved_words = response_body["saved_words"]
+        levels = sorted({word_level(word) for word in saved_words} - {0})
+        if level not in levels:
+            level = 0
+        if level:
+            saved_words = [word for word in saved_words if word_level(word) == level]
+        pages = max(1, -(-len(saved_words) // page_size))
+        page = min(max(page, 0), pages - 1)
+        return {
+            "success": True,
+            "saved_words": saved_words[page * page_size:(page + 1) * page_size],
+            "total": len(saved_words),
+            "page": page,
+            "pages": pages,
+            "level": level,
+            "levels": levels,
+        }
+
+    async def can_train(self, user_id: int) -> dict:
+        return await self.get("/can-train", params={"user_id": user_id})
+
+    async def save_word(self, user_id: int, word_id: int) -> dict:
+        response_body = await self.post("/new-word", data={"user_id": user_id, "word_id": word_id})
+        if is_success(response_body):
+            # the new saved_id is only known to the api, so the next read reloads the list
+            self.saved_cache.pop(user_id)
+        return response_body
+
+    async def delete_saved_word(self, saved_id: int, user_id: int | None = None) -> dict:
+        response_body = await self.delete("/saved_word", params={"saved_id": saved_id})
+        if is_success(response_body) and user_id is not None:
+            cached = self.saved_cache.get(user_id)
+            if cached is not None:
+                saved_words = [word for word in cached["saved_words"] if word["saved_id"] != saved_id]
+                self.saved_cache.set(user_id, {**cached, "saved_words": saved_words})
+        return response_body
+
+    async def _pipelined(self, requests: List[Callable[[], Awaitable[dict]]], concurrency: int) -> List[dict]:
+        # the api has no bulk endpoints, a batch goes out as concurrent requests over the pooled connections
+        limit = asyncio.Semaphore(concurrency)
+
+        async def run(request: Callable[[], Awaitable[dict]]) -> dict:
+            async with limit:
+                try:
+                    return await request()
+                # ValueError: an html error page instead of json, one bad reply must not fail the whole batch
+                except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as error:
+                    return {"success": False, "msg": repr(error)}
+
+        return await asyncio.gather(*(run(request) for request in requests))
+
+    async def save_words(self, user_id: int, word_ids: Iterable[int], concurrency: int = 4) -> List[dict]:
+        responses = await self._pipelined(
+            [lambda word_id=word_id: self.post("/new-word", data={"user_id": user_id, "word_id": word_id}) for word_id in word_ids],
+            concurrency,
+        )
+        if any(is_success(response_body) for response_body in responses):
+            self.saved_cache.pop(user_id)
+        return responses
+
+    async def delete_saved_words(self, saved_ids: Iterable[int], user_id: int | None = None, concurrency: int = 4) -> List[dict]:
+        saved_ids = list(saved_ids)
+        responses = await self._pipelined(
+            [lambda saved_id=saved_id: self.delete("/saved_word", params={"saved_id": saved_id}) for saved_id in saved_ids],
+            concurrency,
+        )
+        deleted = {saved_id for saved_id, response_body in zip(saved_ids, responses) if is_success(response_body)}
+        if deleted and user_id is not None:
+            # one rewrite of the cached list for the whole batch
+            cached = self.saved_cache.get(user_id)
+            if cached is not None:
+                saved_words = [word for word in cached["saved_words"] if word["saved_id"] not in deleted]
+                self.saved_cache.set(user_id, {**cached, "saved_words": saved_words})
+        return responses
+
+    def cache_stats(self) -> dict:
+        return {
+            "chinese_match": self.match_cache.stats(),
+            "word_details": self.details_cache.stats(),
+            "saved_words": self.saved_cache.stats(),
+            "dictionary": self.dictionary.stats() if self.dictionary is not None else None,
+        }
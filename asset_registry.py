@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def build_manifest(directory: str, manifest_path: str) -> Dict[str, dict]:
+    # content hashes of the shipped images, computed at build time instead of on the first send
+    manifest = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.normpath(os.path.join(directory, name))
+        stat = os.stat(path)
+        manifest[path] = {"hash": sha256_file(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+class AssetRegistry:
+    # uploads every image once and sends it by telegram file_id after that,
+    # file ids are kept on disk together with the hash of the uploaded content
+    def __init__(self, cache_path: str = "./assets/file_ids.json", manifest_path: str = "./assets/manifest.json"):
+        self.cache_path = cache_path
+        self._hashes: Dict[str, str] = {}
+        self._file_ids: Dict[str, Dict[str, str]] = self._load(cache_path)
+        # without a manifest (e.g. running from a checkout) files are hashed on first use
+        self._manifest: Dict[str, dict] = self._load(manifest_path)
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            logger.warning("could not read %s, starting empty", path)
+            return {}
+
+    def digest(self, path: str) -> str:
+        if path not in self._hashes:
+            entry = self._manifest.get(os.path.normpath(path))
+            stat = os.stat(path)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self._hashes[path] = entry["hash"]
+            else:
+                self._hashes[path] = sha256_file(path)
+        return self._hashes[path]
+
+    def photo(self, path: str) -> str | FSInputFile:
+        entry = self._file_ids.get(path)
+        if entry is not None and entry["hash"] == self.digest(path):
+            return entry["file_id"]
+        return FSInputFile(path)
+
+    def remember(self, path: str, message: Message):
+        if not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        entry = {"hash": self.digest(path), "file_id": file_id}
+        if self._file_ids.get(path) != entry:
+            self._file_ids[path] = entry
+            self.save()
+
+    def forget(self, *paths: str):
+        for path in paths:
+            self._file_ids.pop(path, None)
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self._file_ids, file, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.cache_path)
+
+    def _is_cached(self, path: str) -> bool:
+        return isinstance(self.photo(path), str)
+
+    async def send_photo(self, bot: Bot, path: str, **kwargs) -> Message:
+        try:
+            message = await bot.send_photo(photo=self.photo(path), **kwargs)
+        except TelegramBadRequest:
+            # file ids belong to a bot token, a stale one is re-uploaded from disk
+            if not self._is_cached(path):
+                raise
+            self.forget(path)
+            message = await bot.send_photo(photo=FSInputFile(path), **kwargs)
+        self.remember(path, message)
+        return message
+
+    async def send_media_group(self, bot: Bot, photos: List[Tuple[str, str | None]], **kwargs) -> List[Message]:
+        def build():
+            return [InputMediaPhoto(media=self.photo(path), caption=caption) for path, caption in photos]
+
+        try:
+            messages = await bot.send_media_group(media=build(), **kwargs)
+        except TelegramBadRequest:
+            cached = [path for path, _ in photos if self._is_cached(path)]
+            if not cached:
+                raise
+            self.forget(*cached)
+            messages = await bot.send_media_group(media=build(), **kwargs)
+        for (path, _), message in zip(photos, messages):
+            self.remember(path, message)
+        return messages
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python asset_registry.py <assets directory> <manifest path>")
+        sys.exit(1)
+    manifest = build_manifest(sys.argv[1], sys.argv[2])
+    print(f"hashed {len(manifest)} assets into {sys.argv[2]}")
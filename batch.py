@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, List
+
+from aiogram.filters.callback_data import CallbackData
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchKind(IntEnum):
+    save = 0
+    delete = 1
+
+
+class BatchAction(IntEnum):
+    select = 0
+    toggle = 1
+    confirm = 2
+    cancel = 3
+
+
+# ints only: `item` is a word_id when saving and a saved_id when deleting
+class BatchCallback(CallbackData, prefix="batch"):
+    kind: BatchKind
+    action: BatchAction
+    item: int = 0
+    page: int = 0
+    level: int = 0
+
+
+class PendingBatch:
+    __slots__ = ("kind", "items", "timer")
+
+    def __init__(self, kind: BatchKind):
+        self.kind = kind
+        # dict keeps the order in which words were picked
+        self.items: Dict[int, None] = {}
+        self.timer: asyncio.Task | None = None
+
+
+class BatchBuffer:
+    # one selection per user, gathered from keyboard taps and sent upstream at once on confirm,
+    # or by the flush callback once the user has been idle for `window` seconds
+    def __init__(self, window: float = 30, max_items: int = 50):
+        self.window = window
+        self.max_items = max_items
+        self._batches: Dict[int, PendingBatch] = {}
+
+    def get(self, user_id: int, kind: BatchKind) -> PendingBatch:
+        batch = self._batches.get(user_id)
+        if batch is None or batch.kind != kind:
+            # switching between saving and deleting drops the other selection
+            self.discard(user_id)
+            batch = self._batches[user_id] = PendingBatch(kind)
+        return batch
+
+    def toggle(self, user_id: int, kind: BatchKind, item: int) -> PendingBatch:
+        batch = self.get(user_id, kind)
+        if item in batch.items:
+            del batch.items[item]
+        elif len(batch.items) < self.max_items:
+            batch.items[item] = None
+        return batch
+
+    def take(self, user_id: int, kind: BatchKind) -> List[int]:
+        # a button from an older keyboard must not send the ids of the other kind of selection
+        batch = self._batches.get(user_id)
+        if batch is None or batch.kind != kind:
+            return []
+        del self._batches[user_id]
+        if batch.timer is not None and batch.timer is not asyncio.current_task():
+            batch.timer.cancel()
+        return list(batch.items)
+
+    def discard(self, user_id: int, kind: BatchKind | None = None):
+        batch = self._batches.get(user_id)
+        if batch is not None and (kind is None or batch.kind == kind):
+            self.take(user_id, batch.kind)
+
+    def schedule(self, user_id: int, flush: Callable[[List[int]], Awaitable[None]] | None = None):
+        # restarts the idle window, without a flush callback the selection is just dropped
+        batch = self._batches.get(user_id)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        batch.timer = asyncio.create_task(self._expire(user_id, batch.kind, flush))
+
+    async def _expire(self, user_id: int, kind: BatchKind, flush: Callable[[List[int]], Awaitable[None]] | None):
+        await asyncio.sleep(self.window)
+        items = self.take(user_id, kind)
+        if flush is not None and items:
+            try:
+                await flush(items)
+            except Exception:
+                logger.exception("idle batch flush failed user_id=%s", user_id)
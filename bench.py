@@ -0,0 +1,292 @@
+"""Replays synthetic updates through the bot's dispatcher against a fake Telegram and a fake api.
+
+    python bench.py --users 500 --concurrency 50 --answers 10 --api-latency 0.02
+
+Every simulated user runs /start, /chinese_match, a search, opens a match, saves it, /saved_words
+and a flash cards session. Users run concurrently, each one's updates in order, like telegram
+delivers them. Reports updates/sec, handler latency, upstream calls per update and peak RSS.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+from aiohttp import web
+
+import main
+import metrics
+from api_client import ChineseBeeApi
+from asset_registry import AssetRegistry
+from batch import BatchBuffer
+from dictionary import open_dictionary
+from flash_cards import FlashCardsEngine
+from rate_limit import FloodControlMiddleware
+from prefetch import DetailsPrefetcher
+from search import QueryScheduler
+
+
+BOT_ID = 4242
+SEARCH_WORDS = ["привет", "мама", "лошадь", "книга", "человек", "счастье", "идти", "линия", "чай", "вода"]
+
+
+class FakeTelegram:
+    # answers bot api methods with the smallest valid result
+    def __init__(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    def message(self, chat_id: int, text: str | None = None) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"},
+            "text": text or "",
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+        if method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText", "sendPhoto"):
+            result = self.message(int(data.get("chat_id", 0)), data.get("text"))
+        elif method == "sendMediaGroup":
+            result = [self.message(int(data.get("chat_id", 0))) for _ in json.loads(data["media"])]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeApi:
+    # stands in for the chinesebee api, every response is delayed by `latency` seconds
+    def __init__(self, latency: float, saved_words: int):
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.saved_words = [
+            {"saved_id": 100000 + index, "word_id": index, "chinese": f"字{index}", "russian": f"слово{index}", "hsk_level": index % 6 + 1}
+            for index in range(saved_words)
+        ]
+
+    def match_ids(self, word: str) -> List[int]:
+        seed = sum(map(ord, word))
+        return [(seed + index) % len(self.saved_words) for index in range(5)]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = request.path
+        endpoint = path if path.count("/") == 1 else path.rsplit("/", 1)[0] + "/{}"
+        self.calls[f"{request.method} {endpoint}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if path.startswith("/chinese-match/"):
+            match = [
+                {"id": word_id, "chinese": f"字{word_id}", "pinyin": "zi", "english": "word", "russian": f"слово{word_id}", "hsk_level": 1}
+                for word_id in self.match_ids(path.removeprefix("/chinese-match/"))
+            ]
+            return web.json_response({"success": True, "match": match})
+        if path.startswith("/word-details/"):
+            word_id = path.rsplit("/", 1)[1]
+            return web.json_response({"success": True, "details": {"chinese": f"字{word_id}", "pinyin": "zi", "russian": f"слово{word_id}"}})
+        if path == "/saved-words":
+            return web.json_response({"success": True, "saved_words": self.saved_words})
+        if path == "/can-train":
+            return web.json_response({"success": True, "can_learn": True})
+        return web.json_response({"success": True})
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.model_validate({"update_id": next(self._update_ids), "message": message})
+
+    def callback(self, user_id: int, data: str) -> Update:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"},
+            "text": "...",
+        }
+        callback_query = {"id": str(next(self._update_ids)), "chat_instance": str(user_id), "from": self.user(user_id), "message": message, "data": data}
+        return Update.model_validate({"update_id": next(self._update_ids), "callback_query": callback_query})
+
+
+def user_script(factory: UpdateFactory, fake_api: FakeApi, user_id: int, answers: int, saved_words: int) -> List[tuple[str, Update]]:
+    word = random.choice(SEARCH_WORDS)
+    # users tap one of the results they were shown
+    word_id = random.choice(fake_api.match_ids(word))
+    script = [
+        ("start", factory.message(user_id, "/start")),
+        ("chinese_match", factory.message(user_id, "/chinese_match")),
+        ("search", factory.message(user_id, word)),
+        ("match_details", factory.callback(user_id, main.MatchChoiceCallback(choice=word_id, searched_word=word).pack())),
+        ("save", factory.callback(user_id, main.SaveWordCallback(word_to_save=word_id, searched_word=word).pack())),
+        ("saved_words", factory.message(user_id, "/saved_words")),
+        ("flash_cards_start", factory.callback(user_id, main.FlashCardsCallback(training=True).pack())),
+    ]
+    for _ in range(answers):
+        question, answer = random.randrange(saved_words), random.randrange(saved_words)
+        script.append(("flash_cards_answer", factory.callback(user_id, main.FlashCardsCallback(training=True, word=question, answer=answer).pack())))
+    return script
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def start_server(path: str, handler, host: str = "127.0.0.1") -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_route("*", path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, 0).start()
+    return runner, f"http://{host}:{runner.addresses[0][1]}"
+
+
+async def run(args: argparse.Namespace) -> dict:
+    telegram = FakeTelegram()
+    fake_api = FakeApi(args.api_latency, args.saved_words)
+    telegram_runner, telegram_url = await start_server("/bot{token}/{method}", telegram.handle)
+    api_runner, api_url = await start_server("/{path:.*}", fake_api.handle)
+
+    bot = Bot(token=f"{BOT_ID}:bench", session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)))
+    if args.flood_control:
+        bot.session.middleware(FloodControlMiddleware())
+    dp = main.dp
+    api = ChineseBeeApi(api_url, dictionary=open_dictionary(args.hsk_index) if args.hsk_index else None)
+    search = QueryScheduler(debounce=0)
+    dp["api"] = api
+    dp["assets"] = AssetRegistry()
+    dp["flash_cards"] = FlashCardsEngine()
+    dp["search"] = search
+    dp["batches"] = BatchBuffer()
+    dp["prefetcher"] = DetailsPrefetcher(api, top=args.prefetch_top)
+
+    factory = UpdateFactory()
+    scripts = [user_script(factory, fake_api, 10_000 + index, args.answers, args.saved_words) for index in range(args.users)]
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    failures = 0
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def play(script: List[tuple[str, Update]]):
+        nonlocal failures
+        async with limit:
+            for kind, update in script:
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception:
+                    failures += 1
+                    logging.exception("update %s failed", kind)
+                latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(script) for script in scripts))
+    # searches are answered in the background, they count towards the wall time as well
+    await search.wait()
+    elapsed = time.perf_counter() - started
+
+    await api.close()
+    await bot.session.close()
+    await telegram_runner.cleanup()
+    await api_runner.cleanup()
+
+    updates = sum(len(script) for script in scripts)
+    every = [value for values in latencies.values() for value in values]
+    upstream_calls = sum(fake_api.calls.values())
+    telegram_calls = sum(telegram.calls.values())
+    return {
+        "updates": updates,
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(updates / elapsed, 1),
+        "p50_ms": round(percentile(every, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(every, 0.99) * 1000, 2),
+        "handlers": {
+            kind: {"count": len(values), "p50_ms": round(percentile(values, 0.5) * 1000, 2), "p99_ms": round(percentile(values, 0.99) * 1000, 2)}
+            for kind, values in latencies.items()
+        },
+        "upstream_calls_per_update": round(upstream_calls / updates, 3),
+        "upstream_calls": dict(fake_api.calls),
+        "telegram_calls_per_update": round(telegram_calls / updates, 3),
+        "telegram_calls": dict(telegram.calls),
+        "upstream_latency": metrics.upstream_seconds.summary(),
+        "cache": api.cache_stats(),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_report(report: dict):
+    print(f"updates          {report['updates']} in {report['seconds']}s ({report['failures']} failed)")
+    print(f"throughput       {report['updates_per_second']} updates/s")
+    print(f"latency          p50 {report['p50_ms']}ms  p99 {report['p99_ms']}ms")
+    for kind, values in report["handlers"].items():
+        print(f"  {kind:<22} n={values['count']:<7} p50 {values['p50_ms']}ms  p99 {values['p99_ms']}ms")
+    print(f"upstream calls   {report['upstream_calls_per_update']} per update")
+    for endpoint, count in sorted(report["upstream_calls"].items()):
+        print(f"  {endpoint:<22} {count}")
+    print(f"telegram calls   {report['telegram_calls_per_update']} per update")
+    print(f"peak rss         {report['peak_rss_mb']} MB")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500, help="simulated users, each runs the whole script")
+    parser.add_argument("--concurrency", type=int, default=50, help="users active at the same time")
+    parser.add_argument("--answers", type=int, default=10, help="flash card answers per user")
+    parser.add_argument("--saved-words", type=int, default=30, help="saved words the fake api returns per user")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds the fake api waits before answering")
+    parser.add_argument("--hsk-index", help="answer chinese match from this index like the bot does with HSK_INDEX")
+    parser.add_argument("--prefetch-top", type=int, default=5, help="search results whose details are prefetched, 0 turns it off")
+    parser.add_argument("--flood-control", action="store_true", help="keep the outgoing telegram rate limits on")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper(), stream=sys.stderr)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
@@ -0,0 +1,130 @@
+"""Measures how fast a fresh `python -m main` answers its first update and how much memory it idles at.
+
+    python bench_startup.py --runs 5
+
+The bot runs in polling mode against a local fake Telegram. The first getUpdates
+returns a /fact message. The clock stops when the answer arrives. Idle RSS is read
+from /proc after the bot has been waiting for updates for a moment. --cold drops the
+app's bytecode before every run, like a container started from an image without it.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import time
+
+from aiohttp import web
+
+
+BOT_ID = 4242
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.delivered = False
+        self.answered = asyncio.Event()
+        self.answered_at = 0.0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        if method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            if self.delivered:
+                # long polling, nothing new
+                await asyncio.sleep(min(float(data.get("timeout") or 1), 1))
+                result = []
+            else:
+                self.delivered = True
+                result = [{
+                    "update_id": 1,
+                    "message": {
+                        "message_id": 1,
+                        "date": int(time.time()),
+                        "chat": {"id": 7, "type": "private"},
+                        "from": {"id": 7, "is_bot": False, "first_name": "user"},
+                        "text": "/fact",
+                        "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+                    },
+                }]
+        elif method == "sendMessage":
+            if not self.answered.is_set():
+                self.answered_at = time.perf_counter()
+                self.answered.set()
+            result = {
+                "message_id": 2,
+                "date": int(time.time()),
+                "chat": {"id": int(data["chat_id"]), "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"},
+                "text": data.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def measure(args: argparse.Namespace) -> tuple[float, float]:
+    telegram = FakeTelegram()
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", telegram.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+
+    env = {
+        **os.environ,
+        "TG_KEY": f"{BOT_ID}:bench",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{runner.addresses[0][1]}",
+        "FSM_STORAGE": "memory",
+        "METRICS_LOG_INTERVAL": "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    if args.cold:
+        # like a fresh container from an image without precompiled bytecode
+        shutil.rmtree("__pycache__", ignore_errors=True)
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-m", "main", env=env)
+    try:
+        await asyncio.wait_for(telegram.answered.wait(), args.timeout)
+        first_update = telegram.answered_at - started
+        await asyncio.sleep(args.idle)
+        idle_rss = rss_mb(process.pid)
+    finally:
+        process.terminate()
+        await process.wait()
+        await runner.cleanup()
+    return first_update, idle_rss
+
+
+async def run(args: argparse.Namespace):
+    first_updates, idle_rss = [], []
+    for _ in range(args.runs):
+        first_update, rss = await measure(args)
+        first_updates.append(first_update)
+        idle_rss.append(rss)
+    print(f"time to first update  median {statistics.median(first_updates) * 1000:.0f}ms  min {min(first_updates) * 1000:.0f}ms  ({args.runs} runs)")
+    print(f"idle rss              median {statistics.median(idle_rss):.1f} MB")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=1.0, help="seconds to idle before reading RSS")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--cold", action="store_true", help="remove the app's __pycache__ before every run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,255 @@
+import csv
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List
+
+
+logger = logging.getLogger(__name__)
+
+# index layout: magic, then three sections (records, sorted keys, sorted trigrams).
+# a section is <count:u32><offsets:u32 * (count + 1)><blob>, offsets are relative to the blob,
+# keys and trigrams are "<text>\0<u32 record ids...>" so both can be binary searched in place
+MAGIC = b"HSKIDX01"
+U32 = struct.Struct("<I")
+
+WORD_SPLIT = re.compile(r"[^\w]+")
+HANZI = re.compile(r"[㐀-鿿]")
+
+
+def normalize_text(text: str) -> str:
+    text = text.casefold().replace("ё", "е")
+    return " ".join(part for part in WORD_SPLIT.split(text) if part)
+
+
+def normalize_pinyin(text: str) -> str:
+    # tone marks, tone numbers and spaces do not matter: "nǐ hǎo" == "ni3hao3" == "nihao"
+    text = unicodedata.normalize("NFD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"[^a-z]", "", text.replace("v", "u"))
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f"^{word}$"
+    return {padded[index:index + 3] for index in range(max(len(padded) - 2, 1))}
+
+
+def entry_keys(entry: dict) -> set[str]:
+    keys = {entry["chinese"], normalize_pinyin(entry["pinyin"])}
+    for field in ("russian", "english"):
+        text = normalize_text(entry.get(field) or "")
+        if text:
+            keys.add(text)
+            keys.update(text.split(" "))
+    keys.discard("")
+    return keys
+
+
+def entry_words(entry: dict) -> set[str]:
+    words = {entry["chinese"], normalize_pinyin(entry["pinyin"])}
+    for field in ("russian", "english"):
+        words.update(normalize_text(entry.get(field) or "").split(" "))
+    words.discard("")
+    return words
+
+
+# MARK: building
+
+
+def pack_section(items: List[bytes]) -> bytes:
+    offsets = [0]
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return U32.pack(len(items)) + struct.pack(f"<{len(offsets)}I", *offsets) + b"".join(items)
+
+
+def pack_postings(text: str, ids: Iterable[int]) -> bytes:
+    ids = sorted(ids)
+    return text.encode() + b"\0" + struct.pack(f"<{len(ids)}I", *ids)
+
+
+def read_dump(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as file:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        elif path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in file if line.strip()]
+        else:
+            rows = json.load(file)
+            if isinstance(rows, dict):
+                rows = rows.get("words") or rows.get("match") or []
+    return [
+        {
+            "id": int(row["id"]),
+            "chinese": row["chinese"],
+            "pinyin": row["pinyin"],
+            "english": row.get("english") or "",
+            "russian": row.get("russian") or "",
+            "hsk_level": int(row.get("hsk_level") or row.get("level") or 0),
+        }
+        for row in rows
+    ]
+
+
+def build_index(entries: List[dict], path: str):
+    keys: Dict[str, set[int]] = defaultdict(set)
+    grams: Dict[str, set[int]] = defaultdict(set)
+    for index, entry in enumerate(entries):
+        for key in entry_keys(entry):
+            keys[key].add(index)
+        for word in entry_words(entry):
+            for gram in trigrams(word):
+                grams[gram].add(index)
+
+    records = [json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode() for entry in entries]
+    # utf-8 byte order is code point order, the reader compares raw bytes
+    key_items = [pack_postings(key, keys[key]) for key in sorted(keys, key=str.encode)]
+    gram_items = [pack_postings(gram, grams[gram]) for gram in sorted(grams, key=str.encode)]
+
+    tmp_path = f"{path}.tmp"
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        for section in (records, key_items, gram_items):
+            file.write(pack_section(section))
+    os.replace(tmp_path, path)
+
+
+# MARK: reading
+
+
+class Section:
+    def __init__(self, buffer: mmap.mmap, start: int):
+        self.buffer = buffer
+        self.count = U32.unpack_from(buffer, start)[0]
+        self.offsets_start = start + 4
+        self.blob_start = self.offsets_start + (self.count + 1) * 4
+        self.end = self.blob_start + U32.unpack_from(buffer, self.offsets_start + self.count * 4)[0]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def bounds(self, index: int) -> tuple[int, int]:
+        begin, end = struct.unpack_from("<2I", self.buffer, self.offsets_start + index * 4)
+        return self.blob_start + begin, self.blob_start + end
+
+    def __getitem__(self, index: int) -> bytes:
+        begin, end = self.bounds(index)
+        return self.buffer[begin:end]
+
+    def text(self, index: int) -> bytes:
+        # only the key is copied out of the map, not its postings
+        begin, end = self.bounds(index)
+        return self.buffer[begin:self.buffer.find(b"\0", begin, end)]
+
+    def ids(self, index: int) -> memoryview:
+        begin, end = self.bounds(index)
+        return memoryview(self.buffer[self.buffer.find(b"\0", begin, end) + 1:end]).cast("I")
+
+    def bisect(self, text: bytes) -> int:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.text(middle) < text:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class HskDictionary:
+    # memory-mapped hsk index built by `python dictionary.py <dump> <index>`,
+    # answers prefix, tone-insensitive pinyin and trigram fuzzy lookups without the api
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an hsk index")
+        self.records = Section(self._buffer, len(MAGIC))
+        self.keys = Section(self._buffer, self.records.end)
+        self.grams = Section(self._buffer, self.keys.end)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def close(self):
+        self._buffer.close()
+
+    def record(self, index: int) -> dict:
+        return json.loads(self.records[index])
+
+    def _prefix(self, prefix: str, limit: int) -> List[int]:
+        encoded = prefix.encode()
+        exact: List[int] = []
+        partial: List[int] = []
+        position = self.keys.bisect(encoded)
+        # stop scanning once enough candidates are found, the closest (shortest) keys come first
+        while position < len(self.keys) and len(exact) + len(partial) < limit:
+            text = self.keys.text(position)
+            if not text.startswith(encoded):
+                break
+            (exact if text == encoded else partial).extend(self.keys.ids(position)[:limit])
+            position += 1
+        return exact + partial
+
+    def _fuzzy(self, word: str, limit: int, threshold: float = 0.5) -> List[int]:
+        query_grams = trigrams(word)
+        scores: Counter[int] = Counter()
+        for gram in query_grams:
+            encoded = gram.encode()
+            position = self.grams.bisect(encoded)
+            if position < len(self.grams) and self.grams.text(position) == encoded:
+                scores.update(self.grams.ids(position))
+        needed = threshold * len(query_grams)
+        return [index for index, score in scores.most_common(limit) if score >= needed]
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        query = query.strip()
+        candidates: List[int] = []
+        if HANZI.search(query):
+            candidates = self._prefix(query, limit) or self._fuzzy(query, limit)
+        else:
+            text = normalize_text(query)
+            pinyin = normalize_pinyin(query)
+            if text:
+                candidates = self._prefix(text, limit)
+            if pinyin and pinyin != text:
+                candidates += self._prefix(pinyin, limit)
+            if not candidates and text:
+                candidates = self._fuzzy(text.replace(" ", ""), limit)
+        unique = list(dict.fromkeys(candidates))[:limit]
+        if unique:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return [self.record(index) for index in unique]
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+def open_dictionary(path: str) -> HskDictionary | None:
+    if not os.path.exists(path):
+        logger.info("no hsk index at %s, chinese match goes to the api only", path)
+        return None
+    return HskDictionary(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python dictionary.py <dump.json|dump.jsonl|dump.csv> <index path>")
+        sys.exit(1)
+    entries = read_dump(sys.argv[1])
+    build_index(entries, sys.argv[2])
+    print(f"indexed {len(entries)} words into {sys.argv[2]}")
@@ -0,0 +1,158 @@
+import heapq
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+
+# leitner boxes, seconds until a card in the box is due again
+INTERVALS = (0, 10 * 60, 60 * 60, 24 * 60 * 60, 3 * 24 * 60 * 60, 7 * 24 * 60 * 60, 30 * 24 * 60 * 60)
+# a wrong answer drops the card to the first box and brings it back shortly
+RETRY_DELAY = 60
+
+
+class Card:
+    __slots__ = ("word_id", "box", "due", "version")
+
+    def __init__(self, word_id: int, due: float, box: int = 0):
+        self.word_id = word_id
+        self.box = box
+        self.due = due
+        self.version = 0
+
+
+class ReviewState:
+    # per user review schedule, the heap gives the next due card in O(log n)
+    __slots__ = ("cards", "words", "word_ids", "heap", "last_word_id", "asked", "left", "answers")
+
+    def __init__(self):
+        self.cards: Dict[int, Card] = {}
+        self.words: Dict[int, dict] = {}
+        self.word_ids: List[int] = []
+        self.heap: List[tuple[float, int, int]] = []
+        self.last_word_id: int | None = None
+        # the card on screen waiting for an answer, None once it is graded
+        self.asked: int | None = None
+        self.left = 0
+        # grows with every graded answer, tells whether the stored progress is newer than this copy
+        self.answers = 0
+
+    def sync(self, saved_words: List[dict], now: float, progress: Dict[str, Any] | None = None):
+        # keeps the progress of words that are still saved, the stored progress wins over this process' copy
+        self.words = {word["word_id"]: word for word in saved_words}
+        self.word_ids = list(self.words)
+        stored = (progress or {}).get("cards", {})
+        cards = {}
+        for word_id in self.word_ids:
+            if str(word_id) in stored:
+                box, due = stored[str(word_id)]
+                cards[word_id] = Card(word_id, due, box)
+            else:
+                # new cards get a little jitter so they are not always asked in saving order
+                cards[word_id] = self.cards.get(word_id) or Card(word_id, now + random.random())
+        self.cards = cards
+        self.answers = max(self.answers, (progress or {}).get("answers", 0))
+        self.heap = [(card.due, card.version, card.word_id) for card in self.cards.values()]
+        heapq.heapify(self.heap)
+
+    def _pop_valid(self) -> tuple[float, int, int] | None:
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            card = self.cards.get(entry[2])
+            if card is not None and card.version == entry[1]:
+                return entry
+        return None
+
+    def next_word(self) -> dict | None:
+        # the most overdue card, or the one due soonest when training ahead
+        first = self._pop_valid()
+        if first is None:
+            return None
+        chosen = first
+        if first[2] == self.last_word_id:
+            second = self._pop_valid()
+            if second is not None:
+                heapq.heappush(self.heap, first)
+                chosen = second
+        heapq.heappush(self.heap, chosen)
+        self.last_word_id = self.asked = chosen[2]
+        return self.words[chosen[2]]
+
+    def grade(self, word_id: int, correct: bool, now: float):
+        card = self.cards.get(word_id)
+        if card is None:
+            return
+        if correct:
+            card.box = min(card.box + 1, len(INTERVALS) - 1)
+            card.due = now + INTERVALS[card.box]
+        else:
+            card.box = 0
+            card.due = now + RETRY_DELAY
+        card.version += 1
+        heapq.heappush(self.heap, (card.due, card.version, card.word_id))
+
+    def dump(self) -> Dict[str, Any]:
+        # what is kept in the fsm storage, json friendly and a few bytes per card
+        return {
+            "cards": {str(card.word_id): [card.box, round(card.due)] for card in self.cards.values()},
+            "asked": self.asked,
+            "left": self.left,
+            "answers": self.answers,
+        }
+
+    def choices(self, word_id: int, count: int) -> List[dict]:
+        # the answer plus sampled distractors, independent of how many words are saved
+        count = min(count, len(self.word_ids))
+        distractors = [other for other in random.sample(self.word_ids, count) if other != word_id][: count - 1]
+        options = [word_id, *distractors]
+        random.shuffle(options)
+        return [self.words[option] for option in options]
+
+
+class FlashCardsEngine:
+    def __init__(self, choices: int = 4, session_size: int = 20, max_users: int = 10000):
+        self.choices = choices
+        self.session_size = session_size
+        self.max_users = max_users
+        self._states: OrderedDict[int, ReviewState] = OrderedDict()
+
+    def state(self, user_id: int) -> ReviewState | None:
+        state = self._states.get(user_id)
+        if state is not None:
+            self._states.move_to_end(user_id)
+        return state
+
+    def start(self, user_id: int, saved_words: List[dict], progress: Dict[str, Any] | None = None, resume: bool = False) -> ReviewState:
+        # this is only a cache of the progress kept in the fsm storage, which survives restarts and is shared by replicas;
+        # resume picks up the session in progress there instead of starting a new one
+        state = self.state(user_id)
+        if state is None:
+            state = self._states[user_id] = ReviewState()
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        state.sync(saved_words, time.time(), progress)
+        if resume and progress:
+            state.asked = progress.get("asked")
+            state.left = progress.get("left", 0)
+        else:
+            state.asked = None
+            state.left = min(len(state.word_ids), self.session_size)
+        return state
+
+    def next_word(self, state: ReviewState) -> dict | None:
+        # None once the session is over
+        if state.left <= 0:
+            state.asked = None
+            return None
+        return state.next_word()
+
+    def answer(self, state: ReviewState, word_id: int, answer_id: int) -> bool | None:
+        # only the card on screen is graded, a second tap on the same keyboard returns None
+        if word_id != state.asked:
+            return None
+        state.asked = None
+        correct = word_id == answer_id
+        state.grade(word_id, correct, time.time())
+        state.left -= 1
+        state.answers += 1
+        return correct
@@ -2,25 +2,44 @@ from aiogram import Bot, Dispatcher, F
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, CallbackQuery, InputMediaPhoto, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.types.web_app_info import WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.callback_data import CallbackData
-import aiohttp
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 import asyncio
 import logging
+from dataclasses import replace
 import sys
 import random
 import os
 
 from pydantic import BaseModel, Field
-from typing import Annotated, Dict
+from typing import Annotated, Dict, List
 
+from api_client import ChineseBeeApi, is_success
+from asset_registry import AssetRegistry
+from batch import BatchAction, BatchBuffer, BatchCallback, BatchKind
+from flash_cards import FlashCardsEngine
+from storage import create_storage
+from search import QueryScheduler
+from prefetch import DetailsPrefetcher
+from dictionary import open_dictionary
+from rate_limit import FloodControlMiddleware
+import metrics
 
 
+logger = logging.getLogger(__name__)
+
+# the fsm storage is picked in main(), importing this module does not create any files
 dp = Dispatcher()
 
-api = "https://chinesebeeapi-production.up.railway.app"
+api_url = os.environ.get("API_URL", "https://chinesebeeapi-production.up.railway.app")
+
+# saved words shown per page of /saved_words
+SAVED_PAGE_SIZE = 10
 
 
 
@@ -63,11 +82,14 @@ class MatchChoiceCallback(CallbackData, prefix="match"):
     choice: int | None = None
     searched_word: str | None = None
     
+# page and level travel with every button of the list, so "back" returns to the same page
 class SavedInfoCallback(CallbackData, prefix="saved"):
     saved_id: int | None = None
     word_to_see: int | None = None
     back: bool | None = None
     start_notebook: bool | None = None
+    page: int = 0
+    level: int = 0
 
 
 class NotebookCallback(CallbackData, prefix="notebook"):
@@ -84,53 +106,117 @@ class SaveWordCallback(CallbackData, prefix="save"):
 class ClearCallback(CallbackData, prefix="clear"):
     clear: bool
 
+# only ids travel in the payload, so it stays far below the 64 byte callback_data limit
 class FlashCardsCallback(CallbackData, prefix="flash_cards"):
     training: bool
-    current: int
-    previous_question: str | None = None
-    previous_answer: str | None = None
+    word: int | None = None
+    answer: int | None = None
 
 class LearnBasicsCallback(CallbackData, prefix="basics"):
     learn: int
 
 
-async def find_chinese_matches(word: str, bot: Bot, chat_id: int):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{api}/chinese-match/{word}") as response:
-            chinese_match_result = await response.json()
-            print(chinese_match_result)
-            if chinese_match_result["success"] == True:
-                matches = chinese_match_result["match"]
-                keyboard_builder = InlineKeyboardBuilder()
-                for match in matches:
-                    keyboard_builder.button(
-                        text=f"{match["chinese"]} - {match["russian"]}",
-                        callback_data=MatchChoiceCallback(choice=match["id"], searched_word=word).pack(),
-                    )
-                keyboard_builder.button(text="🔙 Назад", callback_data=MatchChoiceCallback(choice=None, searched_word=word).pack())
-                keyboard_builder.adjust(1, repeat=True)
-                await bot.send_message(
-                    text="Вот что удалось найти 🕵️", reply_markup=keyboard_builder.as_markup(), chat_id=chat_id
+async def find_chinese_matches(word: str, bot: Bot, api: ChineseBeeApi, chat_id: int, message_id: int | None = None, selected: Dict[int, None] | None = None, prefetcher: DetailsPrefetcher | None = None) -> int | None:
+    chinese_match_result = await api.chinese_match(word)
+    logger.debug("chinese match word=%r success=%s matches=%s", word, chinese_match_result.get("success"), len(chinese_match_result.get("match") or []))
+    if chinese_match_result["success"] == True:
+        matches = chinese_match_result["match"]
+        keyboard_builder = InlineKeyboardBuilder()
+        text = "Вот что удалось найти 🕵️"
+        if selected is None:
+            for match in matches:
+                keyboard_builder.button(
+                    text=f"{match["chinese"]} - {match["russian"]}",
+                    callback_data=MatchChoiceCallback(choice=match["id"], searched_word=word).pack(),
+                )
+            keyboard_builder.button(text="☑️ Выбрать несколько", callback_data=BatchCallback(kind=BatchKind.save, action=BatchAction.select).pack())
+            keyboard_builder.button(text="🔙 Назад", callback_data=MatchChoiceCallback(choice=None, searched_word=word).pack())
+            keyboard_builder.adjust(1, repeat=True)
+            if prefetcher is not None:
+                # the details of the top results load while the list is being sent and read
+                prefetcher.prefetch(chat_id, [match["id"] for match in matches])
+        else:
+            text = "Отметь слова, которые хочешь сохранить"
+            for match in matches:
+                mark = "✅" if match["id"] in selected else "▫️"
+                keyboard_builder.button(
+                    text=f"{mark} {match["chinese"]} - {match["russian"]}",
+                    callback_data=BatchCallback(kind=BatchKind.save, action=BatchAction.toggle, item=match["id"]).pack(),
                 )
+            keyboard_builder.button(text=f"💾 Сохранить выбранные ({len(selected)})", callback_data=BatchCallback(kind=BatchKind.save, action=BatchAction.confirm).pack())
+            keyboard_builder.button(text="✖️ Отмена", callback_data=BatchCallback(kind=BatchKind.save, action=BatchAction.cancel).pack())
+            keyboard_builder.adjust(*[1] * len(matches), 2)
+        # a newer search replaces the previous results instead of adding one more message
+        if message_id:
+            try:
+                await bot.edit_message_text(
+                    text=text, reply_markup=keyboard_builder.as_markup(), chat_id=chat_id, message_id=message_id
+                )
+                return message_id
+            except TelegramBadRequest as error:
+                if "message is not modified" in error.message:
+                    return message_id
+                logger.debug("could not edit results message_id=%s: %s", message_id, error.message)
+        sent = await bot.send_message(
+            text=text, reply_markup=keyboard_builder.as_markup(), chat_id=chat_id
+        )
+        return sent.message_id
+
+
+async def find_saved_words(bot: Bot, api: ChineseBeeApi, user_id: int, chat_id: int, message_id: int | None = None, page: int = 0, level: int = 0, selected: Dict[int, None] | None = None):
+    response_body = await api.saved_words_page(user_id, page, SAVED_PAGE_SIZE, level)
+    if response_body["success"] == True:
+        keyboard_builder = InlineKeyboardBuilder()
+        if not response_body["saved_words"]:
+            await bot.send_message(text="Пока нет сохраненных слов :(\nИспользуй /chinese_match, чтобы найти слова", chat_id=chat_id)
+        else:
+            page, pages, level = response_body["page"], response_body["pages"], response_body["level"]
 
+            # in multi-select mode paging keeps the selection, so it goes through BatchCallback as well
+            def list_callback(page: int, level: int) -> str:
+                if selected is None:
+                    return SavedInfoCallback(back=True, page=page, level=level).pack()
+                return BatchCallback(kind=BatchKind.delete, action=BatchAction.select, page=page, level=level).pack()
 
-async def find_saved_words(bot: Bot, user_id: int, chat_id: int, message_id: int | None = None):
-       async with aiohttp.ClientSession() as session:
-        async with session.get(f"{api}/saved-words?user_id={user_id}") as response:
-            response_body = await response.json()
-            if response_body["success"] == True:
-                keyboard_builder = InlineKeyboardBuilder()
-                if not response_body["saved_words"]:
-                    await bot.send_message(text="Пока нет сохраненных слов :(\nИспользуй /chinese_match, чтобы найти слова", chat_id=chat_id)
+            for saved_word in response_body["saved_words"]:
+                if selected is None:
+                    keyboard_builder.button(text=f"{saved_word["chinese"]} - {saved_word["russian"]}", callback_data=SavedInfoCallback(saved_id=saved_word["saved_id"], word_to_see=saved_word["word_id"], page=page, level=level).pack())
                 else:
-                    for saved_word in response_body["saved_words"]:
-                        keyboard_builder.button(text=f"{saved_word["chinese"]} - {saved_word["russian"]}", callback_data=SavedInfoCallback(saved_id=saved_word["saved_id"], word_to_see=saved_word["word_id"]).pack())
-                    keyboard_builder.adjust(1, True)
-                    # when returning back, we can edit message
-                    if message_id:
-                        await bot.edit_message_text(text="Твои сохраненные слова для изучения 🌻", reply_markup=keyboard_builder.as_markup(), chat_id=chat_id, message_id=message_id)
-                    else:
-                        await bot.send_message(text="Твои сохраненные слова для изучения 🌻", reply_markup=keyboard_builder.as_markup(), chat_id=chat_id)
+                    mark = "✅" if saved_word["saved_id"] in selected else "▫️"
+                    keyboard_builder.button(text=f"{mark} {saved_word["chinese"]} - {saved_word["russian"]}", callback_data=BatchCallback(kind=BatchKind.delete, action=BatchAction.toggle, item=saved_word["saved_id"], page=page, level=level).pack())
+            rows = [1] * len(response_body["saved_words"])
+            if pages > 1:
+                if page > 0:
+                    keyboard_builder.button(text="◀️", callback_data=list_callback(page - 1, level))
+                if page < pages - 1:
+                    keyboard_builder.button(text="▶️", callback_data=list_callback(page + 1, level))
+                rows.append(int(page > 0) + int(page < pages - 1))
+            if len(response_body["levels"]) > 1:
+                for level_filter in (0, *response_body["levels"]):
+                    text = f"HSK {level_filter}" if level_filter else "Все"
+                    keyboard_builder.button(text=f"• {text}" if level_filter == level else text, callback_data=list_callback(0, level_filter))
+                filters = len(response_body["levels"]) + 1
+                rows.extend([4] * (filters // 4) + [filters % 4] * bool(filters % 4))
+            if selected is None:
+                keyboard_builder.button(text="☑️ Выбрать несколько", callback_data=BatchCallback(kind=BatchKind.delete, action=BatchAction.select, page=page, level=level).pack())
+                rows.append(1)
+            else:
+                keyboard_builder.button(text=f"🗑️ Удалить выбранные ({len(selected)})", callback_data=BatchCallback(kind=BatchKind.delete, action=BatchAction.confirm, page=page, level=level).pack())
+                keyboard_builder.button(text="✖️ Отмена", callback_data=BatchCallback(kind=BatchKind.delete, action=BatchAction.cancel, page=page, level=level).pack())
+                rows.append(2)
+            keyboard_builder.adjust(*rows)
+            text = "Твои сохраненные слова для изучения 🌻" if selected is None else "Отметь слова, которые хочешь удалить"
+            if pages > 1:
+                text += f"\nСтраница {page + 1} из {pages}"
+            # when returning back, we can edit message
+            if message_id:
+                try:
+                    await bot.edit_message_text(text=text, reply_markup=keyboard_builder.as_markup(), chat_id=chat_id, message_id=message_id)
+                except TelegramBadRequest as error:
+                    if "message is not modified" not in error.message:
+                        raise
+            else:
+                await bot.send_message(text=text, reply_markup=keyboard_builder.as_markup(), chat_id=chat_id)
 
 
 # endpoint trigger, and below, what it would use (handler)
@@ -153,7 +239,7 @@ async def already_know_basics_hander(query: CallbackQuery, callback_data: LearnB
 
 # to remove repeating functions
 @dp.callback_query(LearnBasicsCallback.filter(F.learn >= 0))
-async def learn_basics_handler(query: CallbackQuery, callback_data: LearnBasicsCallback, bot: Bot):
+async def learn_basics_handler(query: CallbackQuery, callback_data: LearnBasicsCallback, bot: Bot, assets: AssetRegistry):
     keyboard = InlineKeyboardBuilder()
     if callback_data.learn == len(basics_info) - 1:
         keyboard.button(text="Продолжить", callback_data=LearnBasicsCallback(learn=-1).pack())
@@ -170,7 +256,7 @@ async def learn_basics_handler(query: CallbackQuery, callback_data: LearnBasicsC
             await bot.edit_message_text(text=basics_info[callback_data.learn], chat_id=query.message.chat.id, message_id=query.message.message_id, reply_markup=keyboard.as_markup())
     else:
         await bot.delete_message(chat_id=query.message.chat.id, message_id=query.message.message_id)
-        await bot.send_photo(photo=FSInputFile(basics_info[callback_data.learn][1]), caption=basics_info[callback_data.learn][0], chat_id=query.message.chat.id, reply_markup=keyboard.as_markup())
+        await assets.send_photo(bot, basics_info[callback_data.learn][1], caption=basics_info[callback_data.learn][0], chat_id=query.message.chat.id, reply_markup=keyboard.as_markup())
 
 
 # MARK: dictation
@@ -187,52 +273,75 @@ async def dictation_handler(message: Message):
 async def flash_cards_end_handler(query: CallbackQuery, callback_data: FlashCardsCallback, bot: Bot):
     await bot.edit_message_text(text="Спасибо, что уделил время на взращивание своих слов!", chat_id=query.message.chat.id, message_id=query.message.message_id)
 
+def flash_cards_progress(state: FSMContext) -> FSMContext:
+    # the review schedule sits next to the user's fsm state under its own destiny, so state.clear() keeps it
+    return FSMContext(state.storage, replace(state.key, destiny="flash_cards"))
+
 @dp.callback_query(FlashCardsCallback.filter(F.training == True))
-async def flash_cards_train_handler(query: CallbackQuery, callback_data: FlashCardsCallback, bot: Bot):
-    if callback_data.previous_question != None and callback_data.previous_question == callback_data.previous_answer:
-        await query.answer(f"{callback_data.previous_answer} Правильно! 🐝")
-    elif callback_data.previous_question != None and callback_data.previous_question != callback_data.previous_answer:
-        await query.answer(f"Правильный ответ - {callback_data.previous_question}")
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{api}/saved-words?user_id={query.from_user.id}") as response:
-            response_body = await response.json()
-            if response_body["success"] == True:
-                print(query.message.from_user.id)
-                print(query.from_user.id)
-                print(response_body)
-                saved_words = response_body["saved_words"]
-                print(len(saved_words))
-                print(callback_data.current)
-                question_word = saved_words[callback_data.current]
-                random.shuffle(saved_words)
-                keyboard = InlineKeyboardBuilder()
-                for shuffled_word in saved_words:
-                    keyboard.button(text=shuffled_word["russian"], callback_data=FlashCardsCallback(training=True if callback_data.current+1 < len(saved_words) else False, current=callback_data.current+1, previous_question=question_word["chinese"], previous_answer=shuffled_word["chinese"]))
-                keyboard.adjust(1, True)
-                await bot.edit_message_text(text=question_word["chinese"], reply_markup=keyboard.as_markup(), chat_id=query.message.chat.id, message_id=query.message.message_id)
-                
+async def flash_cards_train_handler(query: CallbackQuery, callback_data: FlashCardsCallback, bot: Bot, state: FSMContext, api: ChineseBeeApi, flash_cards: FlashCardsEngine):
+    progress = flash_cards_progress(state)
+    stored = await progress.get_data()
+    resume = callback_data.word != None
+    review = flash_cards.state(query.from_user.id)
+    if not resume or review == None or stored.get("answers", 0) > review.answers:
+        # the list is loaded once when training starts, answers are served from the review state;
+        # after a restart or answers given on another replica the stored progress is picked up again
+        if not resume or review == None:
+            response_body = await api.saved_words(query.from_user.id, fresh=not resume)
+            if response_body["success"] != True:
+                return
+            saved_words = response_body["saved_words"]
+        else:
+            saved_words = list(review.words.values())
+        review = flash_cards.start(query.from_user.id, saved_words, stored, resume=resume)
+        if resume and not stored:
+            # nothing was stored for this session, the card on screen is the one being answered
+            review.asked = callback_data.word
+
+    if resume:
+        correct = flash_cards.answer(review, callback_data.word, callback_data.answer)
+        if correct == None:
+            # a double tap or a tap on an outdated keyboard, the card was graded already
+            await query.answer()
+            return
+        question_word = review.words.get(callback_data.word)
+        if question_word != None and correct:
+            await query.answer(f"{question_word["chinese"]} Правильно! 🐝")
+        elif question_word != None:
+            await query.answer(f"Правильный ответ - {question_word["russian"]}")
+
+    question_word = flash_cards.next_word(review)
+    await progress.set_data(review.dump())
+    if question_word == None:
+        await flash_cards_end_handler(query=query, callback_data=FlashCardsCallback(training=False), bot=bot)
+        return
+    keyboard = InlineKeyboardBuilder()
+    for choice in review.choices(question_word["word_id"], flash_cards.choices):
+        keyboard.button(text=choice["russian"], callback_data=FlashCardsCallback(training=True, word=question_word["word_id"], answer=choice["word_id"]))
+    keyboard.button(text="🛑 Закончить", callback_data=FlashCardsCallback(training=False))
+    keyboard.adjust(1, True)
+    await bot.edit_message_text(text=question_word["chinese"], reply_markup=keyboard.as_markup(), chat_id=query.message.chat.id, message_id=query.message.message_id)
 
 
 @dp.message(Command("flash_cards", prefix="/"))
-async def flash_cards_handler(message: Message):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{api}/can-train?user_id={message.from_user.id}") as response:
-            response_body = await response.json()
-            if response_body["success"]:
-                if response_body["can_learn"] == False:
-                    await message.answer(response_body["msg"])
-                else:
-                    keyboard = InlineKeyboardBuilder()
-                    keyboard.button(text="Начать", callback_data=FlashCardsCallback(training=True, current=0, previous_question=None, previous_answer=None).pack())
-                    keyboard.button(text="Назад", callback_data=ClearCallback(clear=True).pack())
-                    await message.answer("Хочешь потренироваться в запоминании иероглифов?", reply_markup=keyboard.as_markup())
-            else:
-                await message.answer(text=response_body)
+async def flash_cards_handler(message: Message, api: ChineseBeeApi):
+    response_body = await api.can_train(message.from_user.id)
+    if response_body["success"]:
+        if response_body["can_learn"] == False:
+            await message.answer(response_body["msg"])
+        else:
+            keyboard = InlineKeyboardBuilder()
+            keyboard.button(text="Начать", callback_data=FlashCardsCallback(training=True).pack())
+            keyboard.button(text="Назад", callback_data=ClearCallback(clear=True).pack())
+            await message.answer("Хочешь потренироваться в запоминании иероглифов?", reply_markup=keyboard.as_markup())
+    else:
+        await message.answer(text=response_body)
 
 
 @dp.callback_query(ClearCallback.filter(F.clear == True))
-async def clear_state_handler(query: CallbackQuery, bot: Bot, state: FSMContext):
+async def clear_state_handler(query: CallbackQuery, bot: Bot, state: FSMContext, search: QueryScheduler, prefetcher: DetailsPrefetcher):
+    search.cancel(query.message.chat.id)
+    prefetcher.cancel(query.message.chat.id)
     await state.clear()
     if query.message.photo != None:
         await bot.delete_message(chat_id=query.message.chat.id, message_id=query.message.message_id)
@@ -245,61 +354,59 @@ async def clear_state_handler(query: CallbackQuery, bot: Bot, state: FSMContext)
 
 
 @dp.callback_query(NotebookCallback.filter(F.open_page == True))
-async def open_page_handler(query: CallbackQuery, bot: Bot):
+async def open_page_handler(query: CallbackQuery, bot: Bot, assets: AssetRegistry):
     keyboard = InlineKeyboardBuilder()
     keyboard.button(text="Продолжить", callback_data=ClearCallback(clear=True).pack())
     await bot.delete_message(chat_id=query.message.chat.id, message_id=query.message.message_id)
-    await bot.send_photo(caption="Твой лист заполнения", photo=FSInputFile("./assets/blank_form.png"), chat_id=query.message.chat.id, reply_markup=keyboard.as_markup())
+    await assets.send_photo(bot, "./assets/blank_form.png", caption="Твой лист заполнения", chat_id=query.message.chat.id, reply_markup=keyboard.as_markup())
 
 
 @dp.callback_query(NotebookCallback.filter(F.open_guide == True))
-async def open_guide_handler(query: CallbackQuery, bot: Bot):
+async def open_guide_handler(query: CallbackQuery, bot: Bot, assets: AssetRegistry):
     keyboard = InlineKeyboardBuilder()
     keyboard.button(text="Продолжить", callback_data=ClearCallback(clear=True).pack())
     await bot.delete_message(chat_id=query.message.chat.id, message_id=query.message.message_id)
-    await bot.send_media_group(media=[InputMediaPhoto(media=FSInputFile("./assets/similar.png"), caption="Правила работы:\n1. Запомните иероглиф и определите его структуру, разделив на графемы и записав их порядок.\n2. Запишите произношение и значение, а также пиньинь. Повторите произношение с правильным тоном.\n3. Запишите порядок черт иероглифа и сверьте его с онлайн-словарем. При необходимости разбейте иероглиф на части.\n4. Укажите визуально и фонетически похожие иероглифы и запишите их отличия.\n5. Придумайте мнемонику – слово-ассоциацию для запоминания.\n6. Запишите несколько примеров – фраз или предложений.\n7. Пропишите иероглиф в графе «Практика письма» и напишите с ним несколько примеров."),InputMediaPhoto(media=FSInputFile("./assets/structure.png")),InputMediaPhoto(media=FSInputFile("./assets/filled.png"))], chat_id=query.message.chat.id)
+    await assets.send_media_group(bot, [("./assets/similar.png", "Правила работы:\n1. Запомните иероглиф и определите его структуру, разделив на графемы и записав их порядок.\n2. Запишите произношение и значение, а также пиньинь. Повторите произношение с правильным тоном.\n3. Запишите порядок черт иероглифа и сверьте его с онлайн-словарем. При необходимости разбейте иероглиф на части.\n4. Укажите визуально и фонетически похожие иероглифы и запишите их отличия.\n5. Придумайте мнемонику – слово-ассоциацию для запоминания.\n6. Запишите несколько примеров – фраз или предложений.\n7. Пропишите иероглиф в графе «Практика письма» и напишите с ним несколько примеров."), ("./assets/structure.png", None), ("./assets/filled.png", None)], chat_id=query.message.chat.id)
 
 
 @dp.callback_query(SavedInfoCallback.filter(F.back == True))
-async def back_to_saved(query: CallbackQuery, callback_data: SavedInfoCallback, bot: Bot):
-    await find_saved_words(bot=bot, user_id=query.from_user.id, chat_id=query.message.chat.id, message_id=query.message.message_id)
+async def back_to_saved(query: CallbackQuery, callback_data: SavedInfoCallback, bot: Bot, api: ChineseBeeApi):
+    await find_saved_words(bot=bot, api=api, user_id=query.from_user.id, chat_id=query.message.chat.id, message_id=query.message.message_id, page=callback_data.page, level=callback_data.level)
 
 
 @dp.callback_query(SavedInfoCallback.filter((F.saved_id != None) & (F.word_to_see == None)))
-async def delete_saved_handler(query: CallbackQuery, callback_data: SavedInfoCallback, bot: Bot, state: FSMContext):
-    async with aiohttp.ClientSession() as session:
-        async with session.delete(f"{api}/saved_word?saved_id={callback_data.saved_id}") as response:
-            response_body = await response.json()
-            if response_body["success"] == True:
-                await state.clear()
-                await bot.edit_message_text(text="Удаление прошло успешно", chat_id=query.message.chat.id, message_id=query.message.message_id)
+async def delete_saved_handler(query: CallbackQuery, callback_data: SavedInfoCallback, bot: Bot, state: FSMContext, api: ChineseBeeApi):
+    response_body = await api.delete_saved_word(callback_data.saved_id, user_id=query.from_user.id)
+    if response_body["success"] == True:
+        await state.clear()
+        keyboard_builder = InlineKeyboardBuilder()
+        keyboard_builder.button(text="🔙 Назад", callback_data=SavedInfoCallback(back=True, page=callback_data.page, level=callback_data.level).pack())
+        await bot.edit_message_text(text="Удаление прошло успешно", reply_markup=keyboard_builder.as_markup(), chat_id=query.message.chat.id, message_id=query.message.message_id)
 
 
 @dp.callback_query(SavedInfoCallback.filter((F.word_to_see != None) & (F.saved_id != None)))
-async def see_saved_word_handler(query: CallbackQuery, callback_data: SavedInfoCallback, bot: Bot):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{api}/word-details/{callback_data.word_to_see}") as response:
-            response_body = await response.json()
-            if response_body["success"] == True:
-                keyboard_builder = InlineKeyboardBuilder()
-                keyboard_builder.button(text="📘 Открыть лист тетради", callback_data=NotebookCallback(open_page=True).pack())
-                keyboard_builder.button(text="🤔 Как пользоваться тетрадью?", callback_data=NotebookCallback(open_guide=True).pack())
-                keyboard_builder.button(text="🗑️ Удалить", callback_data=SavedInfoCallback(saved_id=callback_data.saved_id).pack())
-                keyboard_builder.button(text="🔙 Назад", callback_data=SavedInfoCallback(back=True).pack())
-                keyboard_builder.adjust(1, repeat=True)
-                await bot.edit_message_text(text="\n".join([f"{key}: {value}" for key, value in response_body["details"].items()]), reply_markup=keyboard_builder.as_markup(), chat_id=query.message.chat.id, message_id=query.message.message_id)
-            else:
-                print(response_body)
+async def see_saved_word_handler(query: CallbackQuery, callback_data: SavedInfoCallback, bot: Bot, api: ChineseBeeApi):
+    response_body = await api.word_details(callback_data.word_to_see)
+    if response_body["success"] == True:
+        keyboard_builder = InlineKeyboardBuilder()
+        keyboard_builder.button(text="📘 Открыть лист тетради", callback_data=NotebookCallback(open_page=True).pack())
+        keyboard_builder.button(text="🤔 Как пользоваться тетрадью?", callback_data=NotebookCallback(open_guide=True).pack())
+        keyboard_builder.button(text="🗑️ Удалить", callback_data=SavedInfoCallback(saved_id=callback_data.saved_id, page=callback_data.page, level=callback_data.level).pack())
+        keyboard_builder.button(text="🔙 Назад", callback_data=SavedInfoCallback(back=True, page=callback_data.page, level=callback_data.level).pack())
+        keyboard_builder.adjust(1, repeat=True)
+        await bot.edit_message_text(text="\n".join([f"{key}: {value}" for key, value in response_body["details"].items()]), reply_markup=keyboard_builder.as_markup(), chat_id=query.message.chat.id, message_id=query.message.message_id)
+    else:
+        logger.warning("word details failed word_id=%s response=%s", callback_data.word_to_see, response_body)
 
 
 @dp.message(Command("saved_words", prefix="/"))
-async def get_saved_words_handler(message: Message, bot: Bot):
-    await find_saved_words(bot=bot, user_id=message.from_user.id, chat_id=message.chat.id)
+async def get_saved_words_handler(message: Message, bot: Bot, api: ChineseBeeApi):
+    await find_saved_words(bot=bot, api=api, user_id=message.from_user.id, chat_id=message.chat.id)
 
 
 @dp.callback_query(SaveWordCallback.filter((F.word_to_save == None) & (F.searched_word != None)))
-async def return_to_picking_handler(query: CallbackQuery, callback_data: SaveWordCallback, bot: Bot):
-    await find_chinese_matches(word=callback_data.searched_word, bot=bot, chat_id=query.message.chat.id)
+async def return_to_picking_handler(query: CallbackQuery, callback_data: SaveWordCallback, bot: Bot, api: ChineseBeeApi, prefetcher: DetailsPrefetcher):
+    await find_chinese_matches(word=callback_data.searched_word, bot=bot, api=api, chat_id=query.message.chat.id, prefetcher=prefetcher)
 
 
 @dp.callback_query(SaveWordCallback.filter(F.should_continue==True))
@@ -311,24 +418,94 @@ async def continue_handler(query: CallbackQuery, callback_data: SaveWordCallback
 
 @dp.callback_query(SaveWordCallback.filter((F.word_to_save != None) & (F.searched_word != None)))
 async def save_word_handler(
-    query: CallbackQuery, callback_data: SaveWordCallback, bot: Bot
+    query: CallbackQuery, callback_data: SaveWordCallback, bot: Bot, api: ChineseBeeApi
 ):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"{api}/new-word",
-            data={"user_id": query.from_user.id, "word_id": callback_data.word_to_save},
-        ) as response:
-            response_body = await response.json()
-            if response_body["success"] == True:
-                keyboard_builder = InlineKeyboardBuilder()
-                keyboard_builder.button(text="Продолжить", callback_data=SaveWordCallback(should_continue=True).pack())
-                keyboard_builder.button(text="Назад", callback_data=SaveWordCallback(word_to_save=None, searched_word=callback_data.searched_word).pack())
-                await bot.edit_message_text(
-                    text="Сохранено в сет на изучение 🌱",
-                    chat_id=query.message.chat.id,
-                    message_id=query.message.message_id,
-                    reply_markup=keyboard_builder.as_markup()
-                )
+    response_body = await api.save_word(query.from_user.id, callback_data.word_to_save)
+    if response_body["success"] == True:
+        keyboard_builder = InlineKeyboardBuilder()
+        keyboard_builder.button(text="Продолжить", callback_data=SaveWordCallback(should_continue=True).pack())
+        keyboard_builder.button(text="Назад", callback_data=SaveWordCallback(word_to_save=None, searched_word=callback_data.searched_word).pack())
+        await bot.edit_message_text(
+            text="Сохранено в сет на изучение 🌱",
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            reply_markup=keyboard_builder.as_markup()
+        )
+
+# MARK: multi-select save and delete
+
+
+async def flush_saves(bot: Bot, api: ChineseBeeApi, user_id: int, chat_id: int, word_ids: List[int], message_id: int | None = None):
+    responses = await api.save_words(user_id, word_ids)
+    saved = sum(is_success(response_body) for response_body in responses)
+    keyboard_builder = InlineKeyboardBuilder()
+    keyboard_builder.button(text="Продолжить", callback_data=SaveWordCallback(should_continue=True).pack())
+    text = f"Сохранено в сет на изучение: {saved} из {len(word_ids)} 🌱"
+    if message_id:
+        await bot.edit_message_text(text=text, reply_markup=keyboard_builder.as_markup(), chat_id=chat_id, message_id=message_id)
+    else:
+        # flushed after the idle window, the results message may already show another search
+        await bot.send_message(text=text, reply_markup=keyboard_builder.as_markup(), chat_id=chat_id)
+
+
+@dp.callback_query(BatchCallback.filter(F.kind == BatchKind.save))
+async def batch_save_handler(query: CallbackQuery, callback_data: BatchCallback, bot: Bot, api: ChineseBeeApi, state: FSMContext, batches: BatchBuffer, prefetcher: DetailsPrefetcher):
+    user_id, chat_id = query.from_user.id, query.message.chat.id
+    if callback_data.action == BatchAction.confirm:
+        word_ids = batches.take(user_id, BatchKind.save)
+        if not word_ids:
+            await query.answer("Ничего не выбрано")
+            return
+        await flush_saves(bot, api, user_id, chat_id, word_ids, message_id=query.message.message_id)
+        return
+
+    searched_word = (await state.get_data()).get("searched_word")
+    if searched_word is None:
+        batches.discard(user_id, BatchKind.save)
+        await query.answer("Поиск устарел, введи слово ещё раз")
+        return
+    selected = None
+    if callback_data.action == BatchAction.cancel:
+        batches.discard(user_id, BatchKind.save)
+    else:
+        if callback_data.action == BatchAction.toggle:
+            batch = batches.toggle(user_id, BatchKind.save, callback_data.item)
+        else:
+            batch = batches.get(user_id, BatchKind.save)
+        # picked words are saved even if the user never presses the button
+        batches.schedule(user_id, lambda word_ids: flush_saves(bot, api, user_id, chat_id, word_ids))
+        selected = batch.items
+    await find_chinese_matches(word=searched_word, bot=bot, api=api, chat_id=chat_id, message_id=query.message.message_id, selected=selected, prefetcher=prefetcher)
+
+
+@dp.callback_query(BatchCallback.filter(F.kind == BatchKind.delete))
+async def batch_delete_handler(query: CallbackQuery, callback_data: BatchCallback, bot: Bot, api: ChineseBeeApi, batches: BatchBuffer):
+    user_id, chat_id, message_id = query.from_user.id, query.message.chat.id, query.message.message_id
+    if callback_data.action == BatchAction.confirm:
+        saved_ids = batches.take(user_id, BatchKind.delete)
+        if not saved_ids:
+            await query.answer("Ничего не выбрано")
+            return
+        responses = await api.delete_saved_words(saved_ids, user_id=user_id)
+        deleted = sum(is_success(response_body) for response_body in responses)
+        keyboard_builder = InlineKeyboardBuilder()
+        keyboard_builder.button(text="🔙 Назад", callback_data=SavedInfoCallback(back=True, page=callback_data.page, level=callback_data.level).pack())
+        await bot.edit_message_text(text=f"Удалено слов: {deleted} из {len(saved_ids)}", reply_markup=keyboard_builder.as_markup(), chat_id=chat_id, message_id=message_id)
+        return
+
+    selected = None
+    if callback_data.action == BatchAction.cancel:
+        batches.discard(user_id, BatchKind.delete)
+    else:
+        if callback_data.action == BatchAction.toggle:
+            batch = batches.toggle(user_id, BatchKind.delete, callback_data.item)
+        else:
+            batch = batches.get(user_id, BatchKind.delete)
+        # deleting needs the explicit confirm, an idle selection is only dropped
+        batches.schedule(user_id)
+        selected = batch.items
+    await find_saved_words(bot=bot, api=api, user_id=user_id, chat_id=chat_id, message_id=message_id, page=callback_data.page, level=callback_data.level, selected=selected)
+
 
 # MARK: facts
 
@@ -348,58 +525,130 @@ async def regect_choices_handler(query: CallbackQuery, bot: Bot):
 
 @dp.callback_query(MatchChoiceCallback.filter(F.choice != None))
 async def show_details_handler(
-    query: CallbackQuery, callback_data: MatchChoiceCallback, bot: Bot
+    query: CallbackQuery, callback_data: MatchChoiceCallback, bot: Bot, api: ChineseBeeApi
 ):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"{api}/word-details/{callback_data.choice}"
-        ) as response:
-            response_body = await response.json()
-            if response_body["success"] == True:
-                details: Dict = response_body["details"]
-                text = "\n".join([f"{key}: {value}" for key, value in details.items()])
-                keyboard_builder = InlineKeyboardBuilder()
-                keyboard_builder.button(
-                    text="Сохранить",
-                    callback_data=SaveWordCallback(
-                        word_to_save=callback_data.choice,
-                        searched_word=callback_data.searched_word
-                    ).pack(),
-                )
-                keyboard_builder.button(
-                    text="🔙 Назад",
-                    callback_data=SaveWordCallback(word_to_save=None, searched_word=callback_data.searched_word).pack(),
-                )
-                await bot.edit_message_text(
-                    text=text,
-                    chat_id=query.message.chat.id,
-                    message_id=query.message.message_id,
-                    reply_markup=keyboard_builder.as_markup(),
-                )
+    response_body = await api.word_details(callback_data.choice)
+    if response_body["success"] == True:
+        details: Dict = response_body["details"]
+        text = "\n".join([f"{key}: {value}" for key, value in details.items()])
+        keyboard_builder = InlineKeyboardBuilder()
+        keyboard_builder.button(
+            text="Сохранить",
+            callback_data=SaveWordCallback(
+                word_to_save=callback_data.choice,
+                searched_word=callback_data.searched_word
+            ).pack(),
+        )
+        keyboard_builder.button(
+            text="🔙 Назад",
+            callback_data=SaveWordCallback(word_to_save=None, searched_word=callback_data.searched_word).pack(),
+        )
+        await bot.edit_message_text(
+            text=text,
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            reply_markup=keyboard_builder.as_markup(),
+        )
 
 
 # MARK: chinese match
 # we can allow to through put to the endpoint the data we want, like message, to then answer, or state to set it
 @dp.message(Command("chinese_match", prefix="/"))
-async def chinese_match_command_handler(message: Message, state: FSMContext):
-    print("test")
+async def chinese_match_command_handler(message: Message, state: FSMContext, prefetcher: DetailsPrefetcher):
+    prefetcher.cancel(message.chat.id)
     await state.set_state(ChineseMatchLookupState.chinese_match)
+    await state.update_data(results_message_id=None)
     await message.answer("Введи слово, которое ты ищешь 🔎")
 
 @dp.message(ChineseMatchLookupState.chinese_match)
-async def search_match_handler(message: Message, bot: Bot):
-    await find_chinese_matches(word=message.text, bot=bot, chat_id=message.chat.id)
+async def search_match_handler(message: Message, bot: Bot, api: ChineseBeeApi, state: FSMContext, search: QueryScheduler, prefetcher: DetailsPrefetcher):
+    async def lookup():
+        data = await state.get_data()
+        results_message_id = await find_chinese_matches(word=message.text, bot=bot, api=api, chat_id=message.chat.id, message_id=data.get("results_message_id"), prefetcher=prefetcher)
+        if results_message_id:
+            # the word is kept for the multi-select keyboard, its payload has room for ids only
+            await state.update_data(results_message_id=results_message_id, searched_word=message.text)
+
+    # answering happens in the background, a quicker follow up message cancels this lookup
+    search.submit(message.chat.id, message.from_user.id, lookup)
 
 
 
 # mark: main
 
 
-async def main():
-    bot = Bot(token=os.environ.get("TG_KEY"))
-    await dp.start_polling(bot)
+webhook_url = os.environ.get("WEBHOOK_URL")
+webhook_path = os.environ.get("WEBHOOK_PATH", "/webhook")
+webhook_secret = os.environ.get("WEBHOOK_SECRET")
+webhook_concurrency = int(os.environ.get("WEBHOOK_CONCURRENCY", 40))
+
+
+metrics_port = os.environ.get("METRICS_PORT")
+metrics_log_interval = float(os.environ.get("METRICS_LOG_INTERVAL", 60))
+
+dp.update.outer_middleware(metrics.UpdateMetricsMiddleware())
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+
+
+@dp.startup()
+async def on_startup(bot: Bot, dispatcher: Dispatcher, api: ChineseBeeApi):
+    if webhook_url:
+        from webhook import register_webhook
+
+        await register_webhook(bot, f"{webhook_url.rstrip("/")}{webhook_path}", secret_token=webhook_secret, max_connections=webhook_concurrency)
+    else:
+        # a webhook left from an earlier deploy makes every getUpdates fail with a 409 conflict
+        await bot.delete_webhook()
+        if metrics_port:
+            dispatcher["metrics_runner"] = await metrics.start_metrics_server(os.environ.get("HOST", "0.0.0.0"), int(metrics_port))
+    if metrics_log_interval > 0:
+        dispatcher["metrics_task"] = asyncio.create_task(
+            metrics.log_summary_periodically(metrics_log_interval, lambda: {"cache": api.cache_stats()})
+        )
+
+
+@dp.shutdown()
+async def on_shutdown(dispatcher: Dispatcher, api: ChineseBeeApi):
+    if "metrics_task" in dispatcher.workflow_data:
+        dispatcher["metrics_task"].cancel()
+    if "metrics_runner" in dispatcher.workflow_data:
+        await dispatcher["metrics_runner"].cleanup()
+    await api.close()
+
+
+def main():
+    # a local bot api server (or a fake one) can be used instead of api.telegram.org
+    telegram_api_url = os.environ.get("TELEGRAM_API_URL")
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_api_url)) if telegram_api_url else None
+    bot = Bot(token=os.environ.get("TG_KEY"), session=session)
+    bot.session.middleware(FloodControlMiddleware())
+    # the docker image points this at /data, which has to be a mounted volume to survive deploys
+    # flash card progress is kept there as well, with cards due up to 30 days ahead
+    dp.fsm.storage = create_storage(os.environ.get("FSM_STORAGE", "sqlite:///fsm.sqlite3"), ttl=float(os.environ.get("FSM_TTL", 90 * 24 * 60 * 60)))
+    dp["api"] = ChineseBeeApi(api_url, dictionary=open_dictionary(os.environ.get("HSK_INDEX", "./data/hsk.idx")))
+    dp["assets"] = AssetRegistry(os.environ.get("ASSET_CACHE", "./assets/file_ids.json"))
+    dp["flash_cards"] = FlashCardsEngine()
+    dp["search"] = QueryScheduler(debounce=float(os.environ.get("SEARCH_DEBOUNCE", 0.4)))
+    dp["batches"] = BatchBuffer(window=float(os.environ.get("BATCH_WINDOW", 30)))
+    dp["prefetcher"] = DetailsPrefetcher(dp["api"], top=int(os.environ.get("PREFETCH_TOP", 5)))
+    if webhook_url:
+        # the web server stack is only imported in webhook mode, polling starts without it
+        from aiohttp import web
+        from webhook import create_app
+
+        # several replicas can run behind a load balancer, telegram posts updates to any of them
+        app = create_app(dp, bot, path=webhook_path, secret_token=webhook_secret, max_concurrency=webhook_concurrency)
+        app.router.add_get("/metrics", metrics.metrics_handler)
+        web.run_app(app, host=os.environ.get("HOST", "0.0.0.0"), port=int(os.environ.get("PORT", 8080)))
+    else:
+        asyncio.run(dp.start_polling(bot))
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    asyncio.run(main=main())
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        stream=sys.stdout,
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+    )
+    main()
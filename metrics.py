@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [per bucket counts (+inf last), sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def quantile(self, labels: Tuple[str, ...], q: float) -> float:
+        # upper bound of the bucket the quantile falls into
+        counts = self.values[labels][0]
+        rank = q * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, f'le="{bound}"')} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            "/".join(labels) or "all": {
+                "count": sum(counts),
+                "avg_ms": round(total / max(sum(counts), 1) * 1000, 2),
+                "p50_ms": self.quantile(labels, 0.5) * 1000,
+                "p99_ms": self.quantile(labels, 0.99) * 1000,
+            }
+            for labels, (counts, total) in self.values.items()
+        }
+
+
+update_seconds = Histogram("bot_update_seconds", "Time spent processing an update", ("event_type",))
+handler_seconds = Histogram("bot_handler_seconds", "Time spent in a handler", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Handler calls that raised", ("handler",))
+upstream_seconds = Histogram("bot_upstream_seconds", "Chinesebee api request latency", ("method", "endpoint"))
+upstream_responses = Counter("bot_upstream_responses_total", "Chinesebee api responses by status", ("method", "endpoint", "status"))
+
+REGISTRY = [update_seconds, handler_seconds, handler_errors, upstream_seconds, upstream_responses]
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # outer middleware on dp.update, measures the whole update including filters
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            update_seconds.observe(time.perf_counter() - started, getattr(event, "event_type", "unknown"))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # inner middleware on message / callback_query observers, here the matched handler is known
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+
+async def metrics_handler(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def log_summary_periodically(interval: float, extra: Callable[[], dict] | None = None):
+    while True:
+        await asyncio.sleep(interval)
+        summary = {
+            "updates": update_seconds.summary(),
+            "handlers": handler_seconds.summary(),
+            "handler_errors": {"/".join(labels): value for labels, value in handler_errors.values.items()},
+            "upstream": upstream_seconds.summary(),
+        }
+        if extra is not None:
+            summary.update(extra())
+        logger.info("metrics %s", json.dumps(summary, ensure_ascii=False, separators=(",", ":")))
+
+
+async def start_metrics_server(host: str, port: int) -> "web.AppRunner":
+    # polling mode has no web app of its own, so /metrics gets a tiny one.
+    # aiohttp.web is only imported when a server is actually started
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
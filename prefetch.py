@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Dict, Iterable
+
+import aiohttp
+
+from api_client import ChineseBeeApi
+
+
+logger = logging.getLogger(__name__)
+
+
+class DetailsPrefetcher:
+    # warms api.details_cache with the top results of a search while the user reads the list,
+    # one prefetch per chat, a newer result list or leaving the search cancels the older one
+    def __init__(self, api: ChineseBeeApi, top: int = 5, concurrency: int = 8):
+        self.api = api
+        self.top = top
+        self._limit = asyncio.Semaphore(concurrency)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def prefetch(self, chat_id: int, word_ids: Iterable[int]):
+        self.cancel(chat_id)
+        word_ids = [word_id for word_id in list(word_ids)[:self.top] if word_id not in self.api.details_cache]
+        if not word_ids:
+            return
+        task = asyncio.create_task(self._run(word_ids))
+        self._tasks[chat_id] = task
+
+        def done(finished: asyncio.Task):
+            if self._tasks.get(chat_id) is finished:
+                del self._tasks[chat_id]
+
+        task.add_done_callback(done)
+
+    def cancel(self, chat_id: int):
+        task = self._tasks.pop(chat_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _run(self, word_ids: list[int]):
+        await asyncio.gather(*(self._fetch(word_id) for word_id in word_ids))
+
+    async def _fetch(self, word_id: int):
+        async with self._limit:
+            try:
+                # a tap on the word while this runs joins the same request through the cache
+                await self.api.word_details(word_id)
+            # ValueError: an html error page instead of json
+            except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as error:
+                logger.debug("prefetch of word_id=%s failed: %r", word_id, error)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Hashable, List
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    Response,
+    TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+
+
+logger = logging.getLogger(__name__)
+
+# only the newest of several queued edits of one message is sent
+MERGEABLE_EDITS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # takes a token right away and returns how long to wait until it is really there,
+        # so concurrent senders line up in arrival order without an explicit queue
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, seconds: float):
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class PendingEdit:
+    # queued edits of one message, only the newest is sent and every caller gets its result
+    __slots__ = ("ready_at", "methods", "sent", "result", "task")
+
+    def __init__(self, ready_at: float):
+        self.ready_at = ready_at
+        self.methods: List[TelegramMethod] = []
+        self.sent = False
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: asyncio.Task | None = None
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    # outgoing requests wait for a per chat and a global token, RetryAfter is waited out and retried,
+    # callback answers skip the queue because telegram expects them within seconds
+    def __init__(
+        self,
+        global_rate: float = 30,
+        private_rate: float = 1,
+        group_rate: float = 20 / 60,
+        burst: float = 3,
+        max_retries: int = 5,
+        max_buckets: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+        self._buckets: Dict[int | str, TokenBucket] = {}
+        self._edits: Dict[Hashable, PendingEdit] = {}
+
+    def _bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                now = time.monotonic()
+                self._buckets = {key: value for key, value in self._buckets.items() if not value.is_idle(now)}
+            # negative ids are groups and channels, telegram allows them ~20 messages a minute
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.private_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    async def _make_request(
+        self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType], bucket: TokenBucket | None
+    ) -> Response[TelegramType]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as error:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("flood control on %s, retrying in %ss", type(method).__name__, error.retry_after)
+                # everybody queued behind this chat (or everybody at all) waits as well
+                (bucket or self.global_bucket).block(error.retry_after)
+                await asyncio.sleep(error.retry_after)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(method, AnswerCallbackQuery) or chat_id is None:
+            return await self._make_request(make_request, bot, method, None)
+
+        bucket = self._bucket(chat_id)
+        if not isinstance(method, MERGEABLE_EDITS) or method.message_id is None:
+            await self._wait(bucket.reserve())
+            return await self._make_request(make_request, bot, method, bucket)
+
+        # edits of a different kind (text vs reply markup) change different things and are all sent
+        edit_key = (chat_id, method.message_id, type(method))
+        edit = self._edits.get(edit_key)
+        if edit is None or edit.sent:
+            edit = self._edits[edit_key] = PendingEdit(time.monotonic() + bucket.reserve())
+            # the send belongs to no caller, so cancelling one of them cannot leave the others waiting
+            edit.task = asyncio.create_task(self._send_edit(edit_key, edit, make_request, bot, bucket))
+        edit.methods.append(method)
+        try:
+            return await asyncio.shield(edit.result)
+        except asyncio.CancelledError:
+            if not edit.sent:
+                # a cancelled caller takes its edit back, the next older one is sent instead
+                edit.methods.remove(method)
+                if not edit.methods:
+                    self._forget(edit_key, edit)
+                    edit.task.cancel()
+            raise
+
+    async def _send_edit(
+        self, edit_key: Hashable, edit: PendingEdit, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, bucket: TokenBucket
+    ):
+        try:
+            delay = edit.ready_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._wait(0)
+            edit.sent = True
+            response = await self._make_request(make_request, bot, edit.methods[-1], bucket)
+        except asyncio.CancelledError:
+            edit.result.cancel()
+            raise
+        except Exception as error:
+            edit.result.set_exception(error)
+            # all callers may be gone by now, mark the exception as retrieved
+            edit.result.exception()
+        else:
+            edit.result.set_result(response)
+        finally:
+            self._forget(edit_key, edit)
+
+    def _forget(self, edit_key: Hashable, edit: PendingEdit):
+        if self._edits.get(edit_key) is edit:
+            del self._edits[edit_key]
+
+    async def _wait(self, chat_delay: float):
+        # the global token is only taken once the chat's turn has come, so a busy chat does not hold it
+        if chat_delay > 0:
+            await asyncio.sleep(chat_delay)
+        global_delay = self.global_bucket.reserve()
+        if global_delay > 0:
+            await asyncio.sleep(global_delay)
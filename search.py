@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryScheduler:
+    # one pending lookup per chat: a newer query cancels the older one, lookups wait for
+    # a short pause in typing and are bounded per user and for the whole process
+    def __init__(self, debounce: float = 0.4, per_user: int = 1, global_limit: int = 50):
+        self.debounce = debounce
+        self.per_user = per_user
+        self._global = asyncio.Semaphore(global_limit)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._user_limits: Dict[int, asyncio.Semaphore] = {}
+        self._user_tasks: Dict[int, int] = {}
+
+    def submit(self, chat_id: int, user_id: int, lookup: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        self.cancel(chat_id)
+        task = asyncio.create_task(self._run(user_id, lookup))
+        self._tasks[chat_id] = task
+        self._user_tasks[user_id] = self._user_tasks.get(user_id, 0) + 1
+
+        def done(finished: asyncio.Task):
+            if self._tasks.get(chat_id) is finished:
+                del self._tasks[chat_id]
+            self._user_tasks[user_id] -= 1
+            if not self._user_tasks[user_id]:
+                # nothing queued for this user anymore, keep memory bounded by active users
+                del self._user_tasks[user_id]
+                self._user_limits.pop(user_id, None)
+            if not finished.cancelled() and finished.exception() is not None:
+                logger.error("lookup failed chat_id=%s", chat_id, exc_info=finished.exception())
+
+        task.add_done_callback(done)
+        return task
+
+    def cancel(self, chat_id: int):
+        task = self._tasks.pop(chat_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _run(self, user_id: int, lookup: Callable[[], Awaitable[Any]]) -> Any:
+        await asyncio.sleep(self.debounce)
+        user_limit = self._user_limits.setdefault(user_id, asyncio.Semaphore(self.per_user))
+        async with user_limit, self._global:
+            return await lookup()
+
+    async def wait(self):
+        # lets callers wait until every scheduled lookup has finished
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
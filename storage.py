@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+logger = logging.getLogger(__name__)
+
+
+def pack_key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def pack_data(data: Dict[str, Any]) -> bytes | None:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def unpack_data(raw: bytes | None) -> Dict[str, Any]:
+    return json.loads(raw) if raw else {}
+
+
+class SQLiteStorage(BaseStorage):
+    # fsm states in a local sqlite file, writes are buffered and flushed in one transaction,
+    # only pending writes are kept in memory and cleared users are deleted from the file
+    def __init__(self, path: str = "fsm.sqlite3", ttl: float = 7 * 24 * 60 * 60, flush_interval: float = 0.5, max_pending: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data BLOB, expires REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires)")
+        # key -> (state, data), a cleared record means the row gets deleted
+        self._pending: Dict[str, tuple[Optional[str], bytes | None]] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._last_purge = 0.0
+
+    def _read(self, key: str) -> tuple[Optional[str], bytes | None]:
+        if key in self._pending:
+            return self._pending[key]
+        row = self._db.execute("SELECT state, data FROM fsm WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def _write(self, key: str, state: Optional[str], data: bytes | None):
+        self._pending[key] = (state, data)
+        if len(self._pending) >= self.max_pending:
+            self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        now = time.time()
+        expires = now + self.ttl
+        try:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "DELETE FROM fsm WHERE key = ?",
+                    [(key,) for key, (state, data) in pending.items() if state is None and data is None],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO fsm (key, state, data, expires) VALUES (?, ?, ?, ?)",
+                    [(key, state, data, expires) for key, (state, data) in pending.items() if state is not None or data is not None],
+                )
+                if now - self._last_purge > 60:
+                    self._db.execute("DELETE FROM fsm WHERE expires <= ?", (now,))
+                    self._last_purge = now
+        except sqlite3.Error:
+            logger.exception("could not flush %s fsm records, keeping them for the next flush", len(pending))
+            self._pending = {**pending, **self._pending}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        packed = pack_key(key)
+        _, data = self._read(packed)
+        self._write(packed, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._read(pack_key(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        packed = pack_key(key)
+        state, _ = self._read(packed)
+        self._write(packed, state, pack_data(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return unpack_data(self._read(pack_key(key))[1])
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self.flush()
+        self._db.close()
+
+
+def create_storage(url: str, ttl: float = 7 * 24 * 60 * 60) -> BaseStorage:
+    # redis://... is shared between replicas, sqlite:///path or a plain path stays on this machine
+    if url.startswith(("redis://", "rediss://")):
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(url, state_ttl=int(ttl), data_ttl=int(ttl))
+    if url == "memory":
+        from aiogram.fsm.storage.memory import MemoryStorage
+
+        return MemoryStorage()
+    return SQLiteStorage(url.removeprefix("sqlite:///"), ttl=ttl)
@@ -0,0 +1,116 @@
+import asyncio
+from typing import Awaitable, Callable, List
+
+from aiohttp import web
+
+from api_client import ChineseBeeApi
+
+
+class FakeApi:
+    # records which client connection served each request
+    def __init__(self, respond: Callable[[web.Request, int], Awaitable[web.Response]] | None = None):
+        self.respond = respond
+        self.peers: List[tuple] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.peers.append(request.transport.get_extra_info("peername"))
+        if self.respond is not None:
+            return await self.respond(request, len(self.peers))
+        return web.json_response({"success": True, "path": request.path})
+
+
+async def serve(fake: FakeApi) -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", fake.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+async def call(fake: FakeApi, requests: Callable[[ChineseBeeApi], Awaitable], **kwargs):
+    runner, url = await serve(fake)
+    api = ChineseBeeApi(url, **kwargs)
+    try:
+        return await requests(api)
+    finally:
+        await api.close()
+        await runner.cleanup()
+
+
+def test_requests_reuse_one_connection():
+    fake = FakeApi()
+
+    async def requests(api: ChineseBeeApi):
+        return [await api.get(f"/word-details/{word_id}") for word_id in range(5)]
+
+    responses = asyncio.run(call(fake, requests))
+
+    assert [response["path"] for response in responses] == [f"/word-details/{word_id}" for word_id in range(5)]
+    assert len(fake.peers) == 5
+    assert len(set(fake.peers)) == 1
+
+
+def test_get_is_retried_after_server_error():
+    async def respond(request: web.Request, attempt: int) -> web.Response:
+        if attempt == 1:
+            return web.json_response({"success": False}, status=503)
+        return web.json_response({"success": True})
+
+    fake = FakeApi(respond)
+    response = asyncio.run(call(fake, lambda api: api.get("/can-train"), backoff=0))
+
+    assert response == {"success": True}
+    assert len(fake.peers) == 2
+
+
+def test_get_is_retried_after_timeout():
+    async def respond(request: web.Request, attempt: int) -> web.Response:
+        if attempt == 1:
+            await asyncio.sleep(1)
+        return web.json_response({"success": True})
+
+    fake = FakeApi(respond)
+    response = asyncio.run(call(fake, lambda api: api.get("/can-train"), timeout=0.2, backoff=0))
+
+    assert response == {"success": True}
+    assert len(fake.peers) == 2
+
+
+def test_post_is_not_retried():
+    async def respond(request: web.Request, attempt: int) -> web.Response:
+        return web.json_response({"success": False}, status=503)
+
+    fake = FakeApi(respond)
+    response = asyncio.run(call(fake, lambda api: api.post("/new-word", data={"user_id": 1, "word_id": 2}), backoff=0))
+
+    assert response == {"success": False}
+    assert len(fake.peers) == 1
+
+
+def test_batch_with_an_html_error_page_keeps_the_other_results():
+    async def respond(request: web.Request, attempt: int) -> web.Response:
+        if request.method == "GET":
+            return web.json_response({"success": True, "saved_words": [{"saved_id": 10, "word_id": 1}, {"saved_id": 20, "word_id": 2}]})
+        item = (await request.post()).get("word_id") or request.query.get("saved_id")
+        if item in ("2", "20"):
+            return web.Response(text="<html>502 Bad Gateway</html>", status=502, content_type="text/html")
+        return web.json_response({"success": True})
+
+    fake = FakeApi(respond)
+
+    async def requests(api: ChineseBeeApi):
+        await api.saved_words(1)
+        saved = await api.save_words(1, [1, 2, 3])
+        # the list is stale once any word was saved
+        stale = 1 in api.saved_cache
+        await api.saved_words(1)
+        deleted = await api.delete_saved_words([10, 20], user_id=1)
+        return saved, stale, deleted, api.saved_cache.get(1)["saved_words"]
+
+    saved, stale, deleted, saved_words = asyncio.run(call(fake, requests, retries=0))
+
+    assert [response["success"] for response in saved] == [True, False, True]
+    assert not stale
+    assert [response["success"] for response in deleted] == [True, False]
+    assert saved_words == [{"saved_id": 20, "word_id": 2}]
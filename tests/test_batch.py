@@ -0,0 +1,33 @@
+import asyncio
+
+from batch import BatchBuffer, BatchKind
+
+
+def test_take_of_the_other_kind_returns_nothing():
+    buffer = BatchBuffer()
+    buffer.toggle(1, BatchKind.save, 5)
+
+    # a delete confirm from an older keyboard must not send word_ids as saved_ids
+    assert buffer.take(1, BatchKind.delete) == []
+    assert buffer.take(1, BatchKind.save) == [5]
+    assert buffer.take(1, BatchKind.save) == []
+
+
+def test_idle_flush_sends_only_its_own_kind():
+    buffer = BatchBuffer(window=0.01)
+    flushed = []
+
+    async def flush(items):
+        flushed.append(items)
+
+    async def scenario():
+        buffer.toggle(1, BatchKind.save, 5)
+        buffer.toggle(1, BatchKind.save, 6)
+        await buffer._expire(1, BatchKind.delete, flush)
+        kept = list(buffer.get(1, BatchKind.save).items)
+        buffer.schedule(1, flush)
+        await asyncio.sleep(0.05)
+        return kept
+
+    assert asyncio.run(scenario()) == [5, 6]
+    assert flushed == [[5, 6]]
@@ -0,0 +1,119 @@
+import asyncio
+
+from cache import AsyncTTLCache
+
+
+def test_load_started_before_an_invalidation_is_not_stored():
+    cache = AsyncTTLCache()
+    release = asyncio.Event()
+    versions = iter(["before save", "after save"])
+
+    async def loader():
+        value = next(versions)
+        if value == "before save":
+            await release.wait()
+        return value
+
+    async def scenario():
+        stale = asyncio.create_task(cache.get_or_load("saved", loader))
+        await asyncio.sleep(0)
+        # a word is saved while the list is loading
+        cache.pop("saved")
+        # joining the older load would wait for it and keep its result
+        fresh = await asyncio.wait_for(cache.get_or_load("saved", loader), 1)
+        release.set()
+        return await stale, fresh, cache.get("saved")
+
+    assert asyncio.run(scenario()) == ("before save", "after save", "after save")
+
+
+def test_concurrent_loads_share_one_call():
+    cache = AsyncTTLCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(cache.get_or_load("key", loader), cache.get_or_load("key", loader))
+
+    assert asyncio.run(scenario()) == ["value", "value"]
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_load():
+    cache = AsyncTTLCache()
+
+    async def loader():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_load("key", loader))
+        second = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(scenario()) == ("value", True)
+    assert cache.get("key") == "value"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AsyncTTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_hits_misses_and_expiry():
+    cache = AsyncTTLCache(ttl=0.05)
+
+    async def loader():
+        return "value"
+
+    async def scenario():
+        await cache.get_or_load("key", loader)
+        await cache.get_or_load("key", loader)
+        await asyncio.sleep(0.06)
+        expired = "key" not in cache
+        await cache.get_or_load("key", loader)
+        return expired
+
+    assert asyncio.run(scenario())
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_failures_are_not_cached():
+    cache = AsyncTTLCache()
+    results = iter([{"success": False}, ValueError("not json"), {"success": True}])
+
+    async def loader():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def scenario():
+        should_cache = lambda value: value["success"]
+        first = await cache.get_or_load("key", loader, should_cache)
+        try:
+            await cache.get_or_load("key", loader, should_cache)
+        except ValueError:
+            pass
+        return first, await cache.get_or_load("key", loader, should_cache)
+
+    assert asyncio.run(scenario()) == ({"success": False}, {"success": True})
+    assert cache.get("key") == {"success": True}
+    assert cache.stats()["misses"] == 3
@@ -0,0 +1,73 @@
+import json
+import time
+
+import pytest
+
+from dictionary import HskDictionary, build_index, read_dump
+
+
+DUMP = [
+    {"id": 1, "chinese": "你好", "pinyin": "nǐ hǎo", "english": "hello", "russian": "привет", "hsk_level": 1},
+    {"id": 2, "chinese": "你", "pinyin": "nǐ", "english": "you", "russian": "ты", "hsk_level": 1},
+    {"id": 3, "chinese": "好", "pinyin": "hǎo", "english": "good", "russian": "хороший", "hsk_level": 1},
+    {"id": 4, "chinese": "谢谢", "pinyin": "xiè xie", "english": "thank you", "russian": "спасибо", "hsk_level": 1},
+    {"id": 5, "chinese": "朋友", "pinyin": "péng you", "english": "friend", "russian": "друг", "hsk_level": 1},
+]
+
+
+@pytest.fixture
+def dictionary(tmp_path):
+    dump = tmp_path / "hsk_dump.json"
+    dump.write_text(json.dumps(DUMP, ensure_ascii=False), encoding="utf-8")
+    build_index(read_dump(str(dump)), str(tmp_path / "hsk.idx"))
+    dictionary = HskDictionary(str(tmp_path / "hsk.idx"))
+    yield dictionary
+    dictionary.close()
+
+
+def ids(matches) -> list:
+    return [match["id"] for match in matches]
+
+
+def test_prefix(dictionary):
+    assert ids(dictionary.search("при")) == [1]
+    assert ids(dictionary.search("thank")) == [4]
+
+
+@pytest.mark.parametrize("query", ["ni3hao3", "nǐ hǎo", "nihao", "NI HAO"])
+def test_pinyin_ignores_tones_and_spaces(dictionary, query):
+    assert ids(dictionary.search(query)) == [1]
+
+
+def test_hanzi_prefix(dictionary):
+    # the exact key comes before the longer words it starts
+    assert ids(dictionary.search("你")) == [2, 1]
+    assert ids(dictionary.search("谢谢")) == [4]
+
+
+def test_typo_falls_back_to_trigrams(dictionary):
+    assert ids(dictionary.search("превет")) == [1]
+
+
+def test_miss(dictionary):
+    assert dictionary.search("xyzzy") == []
+    assert dictionary.stats() == {"size": 5, "hits": 0, "misses": 1}
+
+
+def test_lookup_stays_under_a_millisecond(tmp_path):
+    # about the size of the full hsk list, the bound is loose so a slow machine does not fail it.
+    # only the binary searched lookups, the trigram fallback scans postings and is slower on these look-alike words
+    entries = [
+        {"id": index, "chinese": chr(0x4E00 + index), "pinyin": f"pin{index}", "english": f"word{index}", "russian": f"слово{index}", "hsk_level": 1}
+        for index in range(5000)
+    ]
+    build_index(entries, str(tmp_path / "hsk.idx"))
+    dictionary = HskDictionary(str(tmp_path / "hsk.idx"))
+    queries = ["слово42", "word4999", chr(0x4E00 + 7), "pin123"] * 250
+    started = time.perf_counter()
+    for query in queries:
+        dictionary.search(query)
+    elapsed = (time.perf_counter() - started) / len(queries)
+    dictionary.close()
+
+    assert elapsed < 0.001
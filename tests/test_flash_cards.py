@@ -0,0 +1,47 @@
+from flash_cards import FlashCardsEngine
+
+
+WORDS = [{"word_id": word_id, "chinese": str(word_id), "russian": str(word_id)} for word_id in range(1, 6)]
+
+
+def test_a_card_is_graded_once():
+    engine = FlashCardsEngine()
+    review = engine.start(1, WORDS)
+    word_id = review.next_word()["word_id"]
+    left = review.left
+
+    assert engine.answer(review, word_id, word_id) is True
+    # the same keyboard tapped again
+    assert engine.answer(review, word_id, word_id) is None
+
+    assert review.cards[word_id].box == 1
+    assert review.left == left - 1
+
+
+def test_only_the_card_on_screen_is_graded():
+    engine = FlashCardsEngine()
+    review = engine.start(1, WORDS)
+    asked = review.next_word()["word_id"]
+    other = next(word["word_id"] for word in WORDS if word["word_id"] != asked)
+
+    assert engine.answer(review, other, other) is None
+    assert review.cards[other].box == 0
+    assert engine.answer(review, asked, other) is False
+
+
+def test_progress_is_restored_from_storage():
+    engine = FlashCardsEngine()
+    review = engine.start(1, WORDS)
+    word_id = engine.next_word(review)["word_id"]
+    engine.answer(review, word_id, word_id)
+    asked = engine.next_word(review)["word_id"]
+    progress = review.dump()
+
+    # a restart, or another replica
+    restored = FlashCardsEngine().start(1, WORDS, progress, resume=True)
+
+    assert restored.cards[word_id].box == 1
+    assert restored.cards[word_id].due == round(review.cards[word_id].due)
+    assert restored.asked == asked
+    assert restored.left == review.left
+    assert restored.answers == 1
@@ -0,0 +1,27 @@
+import asyncio
+import json
+
+from cache import AsyncTTLCache
+from prefetch import DetailsPrefetcher
+
+
+class BrokenApi:
+    # the api answers one word with an html error page
+    def __init__(self):
+        self.details_cache = AsyncTTLCache()
+
+    async def word_details(self, word_id: int) -> dict:
+        if word_id == 2:
+            json.loads("<html>502 Bad Gateway</html>")
+        return {"success": True}
+
+
+def test_a_reply_that_is_not_json_does_not_fail_the_prefetch():
+    async def scenario():
+        prefetcher = DetailsPrefetcher(BrokenApi())
+        prefetcher.prefetch(1, [1, 2, 3])
+        task = prefetcher._tasks[1]
+        await asyncio.wait([task])
+        return task.exception()
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from typing import List
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage, TelegramMethod
+
+from rate_limit import FloodControlMiddleware
+
+
+class FakeTelegram:
+    # stands in for the session's make_request, answers every method with its text
+    def __init__(self, retry_after: float = 0):
+        self.retry_after = retry_after
+        self.sent: List[TelegramMethod] = []
+
+    async def make_request(self, bot, method: TelegramMethod):
+        self.sent.append(method)
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(method, "Too Many Requests", retry_after)
+        return getattr(method, "text", None) or True
+
+
+def edit(text: str) -> EditMessageText:
+    return EditMessageText(chat_id=1, message_id=2, text=text)
+
+
+async def busy(middleware: FloodControlMiddleware, telegram: FakeTelegram):
+    # takes the chat's only token, so the next edit has to wait for its turn
+    await middleware(telegram.make_request, None, SendMessage(chat_id=1, text="first"))
+
+
+def test_back_to_back_edits_send_only_the_newest():
+    telegram = FakeTelegram()
+    middleware = FloodControlMiddleware()
+
+    async def scenario():
+        return await asyncio.gather(*(middleware(telegram.make_request, None, edit(text)) for text in "abc"))
+
+    assert asyncio.run(scenario()) == ["c", "c", "c"]
+    assert [method.text for method in telegram.sent] == ["c"]
+
+
+def test_cancelled_sole_caller_drops_the_edit():
+    telegram = FakeTelegram()
+    middleware = FloodControlMiddleware(private_rate=10, burst=1)
+
+    async def scenario():
+        await busy(middleware, telegram)
+        caller = asyncio.create_task(middleware(telegram.make_request, None, edit("a")))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.2)
+        return caller.cancelled()
+
+    assert asyncio.run(scenario())
+    assert [method.text for method in telegram.sent] == ["first"]
+    assert middleware._edits == {}
+
+
+def test_cancelled_newest_caller_falls_back_to_the_older_edit():
+    telegram = FakeTelegram()
+    middleware = FloodControlMiddleware(private_rate=10, burst=1)
+
+    async def scenario():
+        await busy(middleware, telegram)
+        older = asyncio.create_task(middleware(telegram.make_request, None, edit("a")))
+        newest = asyncio.create_task(middleware(telegram.make_request, None, edit("b")))
+        await asyncio.sleep(0.01)
+        newest.cancel()
+        # used to wait forever for the cancelled caller's edit
+        return await asyncio.wait_for(older, 1)
+
+    assert asyncio.run(scenario()) == "a"
+    assert [method.text for method in telegram.sent] == ["first", "a"]
+
+
+def test_retry_after_is_waited_out_and_retried():
+    telegram = FakeTelegram(retry_after=0.2)
+    middleware = FloodControlMiddleware()
+
+    async def scenario():
+        started = time.monotonic()
+        result = await middleware(telegram.make_request, None, SendMessage(chat_id=1, text="hello"))
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result == "hello"
+    assert len(telegram.sent) == 2
+    assert elapsed >= 0.2
+
+
+def test_callback_answers_skip_the_buckets():
+    telegram = FakeTelegram()
+    # one message a minute for the chat, anything queued behind it would time out below
+    middleware = FloodControlMiddleware(private_rate=1 / 60, burst=1)
+
+    async def scenario():
+        await busy(middleware, telegram)
+        answers = [middleware(telegram.make_request, None, AnswerCallbackQuery(callback_query_id=str(i))) for i in range(5)]
+        return await asyncio.wait_for(asyncio.gather(*answers), 1)
+
+    assert asyncio.run(scenario()) == [True] * 5
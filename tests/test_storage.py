@@ -0,0 +1,98 @@
+import asyncio
+import sqlite3
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import SQLiteStorage
+
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=3)
+
+
+def rows(path) -> list:
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT key, state, data FROM fsm").fetchall()
+
+
+def test_state_and_data_survive_reopen(tmp_path):
+    path = tmp_path / "fsm.sqlite3"
+
+    async def scenario():
+        storage = SQLiteStorage(str(path))
+        await storage.set_state(KEY, "Search:word")
+        await storage.set_data(KEY, {"searched_word": "你好"})
+        await storage.close()
+
+        storage = SQLiteStorage(str(path))
+        try:
+            return await storage.get_state(KEY), await storage.get_data(KEY)
+        finally:
+            await storage.close()
+
+    assert asyncio.run(scenario()) == ("Search:word", {"searched_word": "你好"})
+
+
+def test_clear_deletes_the_row(tmp_path):
+    path = tmp_path / "fsm.sqlite3"
+
+    async def scenario():
+        storage = SQLiteStorage(str(path))
+        await storage.set_state(KEY, "Search:word")
+        storage.flush()
+        stored = rows(path)
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+        return stored
+
+    assert len(asyncio.run(scenario())) == 1
+    assert rows(path) == []
+
+
+def test_expired_rows_are_not_returned(tmp_path):
+    path = tmp_path / "fsm.sqlite3"
+
+    async def scenario():
+        storage = SQLiteStorage(str(path), ttl=-1)
+        await storage.set_state(KEY, "Search:word")
+        storage.flush()
+        try:
+            return await storage.get_state(KEY), await storage.get_data(KEY)
+        finally:
+            await storage.close()
+
+    assert asyncio.run(scenario()) == (None, {})
+
+
+def test_writes_are_flushed_at_max_pending(tmp_path):
+    path = tmp_path / "fsm.sqlite3"
+
+    async def scenario():
+        # a long interval, so only the max_pending limit can flush
+        storage = SQLiteStorage(str(path), flush_interval=60, max_pending=3)
+        for user_id in range(2):
+            await storage.set_state(StorageKey(bot_id=1, chat_id=user_id, user_id=user_id), "Search:word")
+        before = rows(path)
+        await storage.set_state(KEY, "Search:word")
+        after = rows(path)
+        await storage.close()
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before == []
+    assert len(after) == 3
+
+
+def test_failed_flush_keeps_the_writes(tmp_path):
+    path = tmp_path / "fsm.sqlite3"
+
+    async def scenario():
+        storage = SQLiteStorage(str(path), flush_interval=60)
+        await storage.set_state(KEY, "Search:word")
+        storage._db.execute("DROP TABLE fsm")
+        storage.flush()
+        pending = dict(storage._pending)
+        storage._db.close()
+        return pending
+
+    assert list(asyncio.run(scenario()).values()) == [("Search:word", None)]
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import create_app
+
+
+# an update as telegram posts it to the webhook
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": 7, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "user"},
+        "text": "/fact",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+    },
+}
+
+
+def test_posted_update_reaches_the_handlers():
+    dispatcher = Dispatcher()
+    handled = []
+
+    @dispatcher.message()
+    async def record(message: Message):
+        handled.append(message.text)
+
+    async def scenario():
+        app = create_app(dispatcher, Bot("42:TEST"), secret_token="secret")
+        async with TestClient(TestServer(app)) as client:
+            health = await client.get("/health")
+            rejected = await client.post("/webhook", json=UPDATE)
+            accepted = await client.post("/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "secret"})
+            return health.status, await health.json(), rejected.status, accepted.status
+
+    assert asyncio.run(scenario()) == (200, {"ok": True}, 401, 200)
+    assert handled == ["/fact"]
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+
+def concurrency_limit(max_concurrency: int, path: str):
+    # updates above the limit wait for a free slot, so a busy replica pushes back on telegram / the load balancer
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        if request.path != path:
+            return await handler(request)
+        async with semaphore:
+            return await handler(request)
+
+    return middleware
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    return web.json_response({"ok": True})
+
+
+def create_app(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    path: str = "/webhook",
+    secret_token: str | None = None,
+    max_concurrency: int = 40,
+) -> web.Application:
+    app = web.Application(middlewares=[concurrency_limit(max_concurrency, path)])
+    app.router.add_get("/health", health_handler)
+    # updates are handled inside the request, so the concurrency limit above really bounds the work
+    SimpleRequestHandler(
+        dispatcher=dispatcher, bot=bot, handle_in_background=False, secret_token=secret_token
+    ).register(app, path=path)
+    # runs dispatcher startup / shutdown hooks together with the web app
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def register_webhook(bot: Bot, url: str, secret_token: str | None = None, max_connections: int = 40):
+    # every replica sets the same url, so this is safe to call on each start
+    logger.info("setting webhook to %s", url)
+    await bot.set_webhook(url=url, secret_token=secret_token, max_connections=max_connections)